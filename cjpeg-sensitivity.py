@@ -1,26 +1,34 @@
 #! /usr/bin/env python3
 """
 Simple sensitivity analysis to different quality combinations
-for luminance and chrominance
+for luminance and chrominance. Uses either the quantization tables of
+cjpeg-generated test images (with quality levels from their file names, or
+from the manifest written by generate-testimages-grid.py), or (with
+--synthetic) the same tables generated directly from the standard base
+tables, without any images
 """
 
 import os
-import math
 import argparse
 import csv
-from PIL import Image
+from jpegquality import readQuantizationTables
+from jpegquality.inputs import addInputArguments, checkInputArguments, getInputPaths
+from jpegquality.lsm import (computeJPEGQuality_lsm_ties, computeJPEGQuality_lsm_batch,
+                             scaleTables, stackTables, LUM_BASE, CHROM_BASE, QUALITIES)
+from jpegquality.cache import fingerprint
+import numpy as np
 import pandas as pd
 from matplotlib import pylab
 from matplotlib import pyplot as plt
+from matplotlib.colors import LogNorm
+
+# Columns of results dataframe
+COLUMNS = ["Qlum", "Qchrom", "Qav", "Qlsm", "deltaQ", "RMSE", "NSE"]
 
 def parseCommandLine():
     """Parse command line"""
     parser = argparse.ArgumentParser()
-    parser.add_argument('JPEGsIn',
-                        action="store",
-                        type=str,
-                        nargs='+',
-                        help="input JPEGs")
+    addInputArguments(parser)
     parser.add_argument('-x',
                         action="store",
                         type = int,
@@ -33,158 +41,83 @@ def parseCommandLine():
                         help="vertical position of text annotation",
                         dest="textYpos",
                         default=None)
+    parser.add_argument('--synthetic',
+                        action="store_true",
+                        help="generate the tables of all luminance and chrominance quality \
+                        combinations directly, instead of reading them from images",
+                        dest="syntheticFlag",
+                        default=False)
+    parser.add_argument('--manifest',
+                        action="store",
+                        type=str,
+                        help="use all images in manifest file of generate-testimages-grid.py, \
+                        instead of input files",
+                        dest="manifestFile",
+                        default=None)
+    parser.add_argument('--density',
+                        action="store_true",
+                        help="plot number of images in 2D bins instead of scatter plots \
+                        (for large numbers of images)",
+                        dest="densityFlag",
+                        default=False)
+    parser.add_argument('--bins',
+                        action="store",
+                        type=int,
+                        help="number of bins along each axis of density plots (default: 100)",
+                        dest="bins",
+                        default=100)
 
     # Parse arguments
     args = parser.parse_args()
+    if not args.syntheticFlag and args.manifestFile is None:
+        checkInputArguments(parser, args)
+    if args.bins < 1:
+        parser.error("--bins must be at least 1")
 
     return args
 
 
-def computeJPEGQuality(image):
-    """Estimates JPEG quality using least squares matching between image
-    quantization tables and standard tables from the JPEG ISO standard.
-    
-    This compares the image quantization tables against the standard quantization
-    tables for *all* possible quality levels, which are generated using
-    Equations 1 and 2 in Kornblum (2008):
-
-    https://www.sciencedirect.com/science/article/pii/S1742287608000285
-
-    Returns quality estimate, root mean squared error of residuals between
-    image quantization coefficients and corresponding standard coefficients,
-    and Nash-Sutcliffe Efficiency measure.
-    """
-
-    # Standard JPEG luminance and chrominance quantization tables
-    # for 50% quality (ISO/IEC 10918-1 : 1993(E)), Annex K)
-    lum_base = [16, 11, 10, 16, 24, 40, 51, 61,
-                12, 12, 14, 19, 26, 58, 60, 55,
-                14, 13, 16, 24, 40, 57, 69, 56,
-                14, 17, 22, 29, 51, 87, 80, 62,
-                18, 22, 37, 56, 68, 109, 103, 77,
-                24, 35, 55, 64, 81, 104, 113, 92,
-                49, 64, 78, 87, 103, 121, 120, 101,
-                72, 92, 95, 98, 112, 100, 103, 99]
-
-    chrom_base = [17, 18, 24, 47, 99, 99, 99, 99,
-                  18, 21, 26, 66, 99, 99, 99, 99,
-                  24, 26, 56, 99, 99, 99, 99, 99,
-                  47, 66, 99, 99, 99, 99, 99, 99,
-                  99, 99, 99, 99, 99, 99, 99, 99,
-                  99, 99, 99, 99, 99, 99, 99, 99,
-                  99, 99, 99, 99, 99, 99, 99, 99,
-                  99, 99, 99, 99, 99, 99, 99, 99]
-
-    # Image quantization tables
-    qdict = image.quantization
-    noTables = len(qdict)
-
-    # Default quantization table bit depth
-    qBitDepth = 8
-
-    if max(qdict[0]) > 255:
-        # Any values greater than 255 indicate bir depth 16 
-        qBitDepth = 16
-    if noTables >= 2:
-        if max(qdict[1]) > 255:
-            qBitDepth = 16
-
-    # Calculate mean of all value in quantization tables
-    Tsum = sum(qdict[0])
-    if noTables >= 2:
-        Tsum += sum(qdict[1])
-    Tmean = Tsum / (noTables*64)
-
-    # List for storing squared error values
-    errors = []
-
-    # List for storing Nash–Sutcliffe Efficiency values
-    nseVals = []
-
-    # Iterate over all quality levels
-    for i in range(100):
-        # Quality level
-        Q = i+1
-        # Scaling factor (Eq 1 in Kornblum, 2008)
-        if Q < 50:
-            S = 5000/Q
-        else:
-            S = 200 - 2*Q
-
-        # Initialize sum of squared differences between image quantization values
-        # and corresponding values from standard q tables for this quality level
-        sumSqErrors = 0
-
-        # Initialize sum of squared differences between image quantization values
-        # and mean image quantization value (needed to calculate Nash Efficiency)
-        sumSqMean = 0
-
-        # Iterate over all values in quantization tables for this quality
-        for j in range(64):
-            # Compute standard luminance table value from scaling factor
-            # (Eq 2 in Kornblum, 2008)
-            Tslum = max(math.floor((S*lum_base[j] + 50) / 100), 1)
-            # Cap Tslum at 255 if bit depth is 8
-            if qBitDepth == 8:
-                Tslum = min(Tslum, 255)
-            # Update sum of squared errors relative to corresponding
-            # image table value
-            sumSqErrors += (qdict[0][j] - Tslum)**2
-
-            # Sum of luminance and chrominance values          
-            Tcombi = qdict[0][j]
-
-            if noTables >= 2:
-                # Compute standard chrominance table value from scaling factor
-                # (Eq 2 in Kornblum, 2008)
-                Tschrom = max(math.floor((S*chrom_base[j] + 50) / 100), 1)
-                # Cap Tschrom at 255 if bit depth is 8
-                if qBitDepth == 8:
-                    Tschrom = min(Tschrom, 255)
-                # Update sum of squared errors relative to corresponding
-                # image table value
-                sumSqErrors  += (qdict[1][j] - Tschrom)**2
-
-                # Update sum of luminance and chrominance values
-                Tcombi += qdict[1][j]
-
-            # Update sumSqMMean
-            sumSqMean += (Tcombi - Tmean)**2
-
-            j += 1
-
-        # Calculate Nash-Sutcliffe Effiency
-        nse = 1 - sumSqErrors/sumSqMean
-
-        # Add calculated statistics to lists
-        errors.append(sumSqErrors)
-        nseVals.append(nse)
-
-    # Quality is estimated as level with smallest sum of squared errors
-    # Note that this will return the smallest quality level in case
-    # the smallest SSE occurs for more than one level!
-    # TODO: perhaps add a check for this and report as output?
-    #qualityEst = errors.index(min(errors)) + 1
-    # Corresponding SSE. Value 0 indicates exact match with standard JPEG
-    # quantization tables. Any other value means non-standard tables were
-    # used, and quality estimate is an approximation
-    sumSqErrors = min(errors)
-    # List of all qualities that match sumSqErrors
-    qualityEstimates = [i + 1 for i, x in enumerate(errors) if x == sumSqErrors]
-
-    # Compute corresponding root mean squared error
-    rmsError = round(math.sqrt(sumSqErrors / (noTables * 64)), 3)
-    nse = round(max(nseVals), 3)
-    return qualityEstimates, rmsError, nse
+def getSyntheticTables(lumBase=LUM_BASE, chromBase=CHROM_BASE):
+    """Returns arrays with luminance and chrominance quality levels of all
+    10 thousand combinations, and N x 128 array with corresponding tables,
+    scaled from the base tables as cjpeg does (without -baseline, so values
+    are not capped at 255)"""
+    lumTables = scaleTables(lumBase, 16)
+    chromTables = scaleTables(chromBase, 16)
+    qlums = np.repeat(QUALITIES, len(QUALITIES))
+    qchroms = np.tile(QUALITIES, len(QUALITIES))
+    tables = np.hstack((lumTables[qlums - 1], chromTables[qchroms - 1]))
+    return qlums, qchroms, tables
 
 
-def main():
-    args = parseCommandLine()
-    myJPEGs =  args.JPEGsIn
-    myJPEGs.sort()
-    textXpos = args.textXpos
-    textYpos = args.textYpos
+def analyseSynthetic():
+    """Returns list with results for synthetic tables of all quality
+    combinations, estimated in one batch"""
+    listOut = []
+    qlums, qchroms, tables = getSyntheticTables()
+    noTables = np.full(len(tables), 2)
+    _, rmses, nses, ties, _, _ = computeJPEGQuality_lsm_batch(tables, noTables, ties=True)
+
+    for qlum, qchrom, rmse, nse, qualities in zip(qlums.tolist(), qchroms.tolist(),
+                                                  rmses.tolist(), nses.tolist(), ties):
+        qav = (qlum + qchrom)/2
+        # Rounded as computeJPEGQuality_lsm_ties
+        rmse = round(rmse, 3)
+        nse = round(nse, 3)
+        qualities = qualities.tolist()
+        if len(qualities) >= 2:
+            print("multiple matches for qlum {}, qchrom {} with quality estimates:".format(qlum, qchrom))
+            for quality in qualities:
+                print(quality)
+        for quality in qualities:
+            deltaQ = abs(quality - qav)
+            listOut.append([qlum, qchrom, qav, quality, deltaQ, rmse, nse])
+    return listOut
+
 
+def analyseFiles(myJPEGs):
+    """Returns list with results for cjpeg-generated images, with luminance
+    and chrominance quality levels taken from the file names"""
     listOut = []
 
     for myJPEG in myJPEGs:
@@ -196,9 +129,8 @@ def main():
         qav = (qlum + qchrom)/2
 
         with open(myJPEG, 'rb') as fIn:
-            im = Image.open(fIn)
-            im.load()
-            qualities, rmse, nse,  = computeJPEGQuality(im)
+            qdict = readQuantizationTables(fIn)
+            qualities, rmse, nse,  = computeJPEGQuality_lsm_ties(qdict)
             noMatches = len(qualities)
             if noMatches >= 2:
                 print("multiple matches for {} with quality estimates:".format(fileName))
@@ -207,20 +139,98 @@ def main():
             for quality in qualities:
                 deltaQ = abs(quality - qav)
                 listOut.append([qlum, qchrom, qav, quality, deltaQ, rmse, nse])
+    return listOut
+
+
+def analyseManifest(manifestFile):
+    """Returns dataframe with results for all images in manifest file, which
+    are estimated in one batch and then joined with the quality levels in
+    the manifest"""
+    manifest = pd.read_csv(manifestFile, dtype={"path": str, "fingerprint": str})
+    # Paths in manifest are relative to its directory
+    manifestDir = os.path.dirname(manifestFile)
+    qdicts = []
+    for path in manifest["path"]:
+        with open(os.path.join(manifestDir, path), 'rb') as fIn:
+            qdicts.append(readQuantizationTables(fIn))
+
+    fingerprints = [fingerprint(qdict) for qdict in qdicts]
+    noChanged = (manifest["fingerprint"] != fingerprints).sum()
+    if noChanged > 0:
+        print("warning: tables of {} images don't match manifest".format(noChanged))
+
+    tables, noTables = stackTables(qdicts)
+    _, rmses, nses, ties, _, _ = computeJPEGQuality_lsm_batch(tables, noTables, ties=True)
+    for path, qualities in zip(manifest["path"], ties):
+        if len(qualities) >= 2:
+            print("multiple matches for {} with quality estimates:".format(path))
+            for quality in qualities:
+                print(quality)
+
+    # One row for each tied quality estimate, as analyseFiles
+    results = pd.DataFrame({"path": manifest["path"],
+                            "Qlsm": [qualities.tolist() for qualities in ties],
+                            "RMSE": [round(rmse, 3) for rmse in rmses.tolist()],
+                            "NSE": [round(nse, 3) for nse in nses.tolist()]})
+    results = results.explode("Qlsm").astype({"Qlsm": int})
+    df = results.merge(manifest[["path", "qlum", "qchrom"]], on="path")
+    df = df.rename(columns={"qlum": "Qlum", "qchrom": "Qchrom"})
+    df["Qav"] = (df["Qlum"] + df["Qchrom"])/2
+    df["deltaQ"] = (df["Qlsm"] - df["Qav"]).abs()
+    return df[COLUMNS]
+
+
+def plotDensity(x, y, bins, xlabel, ylabel):
+    """Returns figure and axes with 2D histogram of x and y, with log scaled
+    colours. The counts are computed with NumPy, so plotting time and memory
+    don't depend on the number of points"""
+    finite = np.isfinite(x) & np.isfinite(y)
+    counts, xEdges, yEdges = np.histogram2d(x[finite], y[finite], bins=bins)
+    # Empty bins are left blank
+    counts = np.ma.masked_equal(counts, 0)
+    fig, ax = plt.subplots()
+    mesh = ax.pcolormesh(xEdges, yEdges, counts.T, norm=LogNorm(), cmap='viridis')
+    fig.colorbar(mesh, ax=ax, label='number of images')
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    return fig, ax
 
-    # Convert list to Pandas dataframe
-    df = pd.DataFrame(listOut, columns=["Qlum", "Qchrom", "Qav", "Qlsm", "deltaQ", "RMSE", "NSE"])
 
-    # Scatter plot of average encoding Q vs lsm estimate
-    qPlot = df.plot.scatter(x = 'Qav', y = 'Qlsm', s = 1, color = 'b')
+def main():
+    args = parseCommandLine()
+    textXpos = args.textXpos
+    textYpos = args.textYpos
+
+    if args.manifestFile is not None:
+        df = analyseManifest(args.manifestFile)
+    else:
+        if args.syntheticFlag:
+            listOut = analyseSynthetic()
+        else:
+            listOut = analyseFiles(getInputPaths(args))
+        # Convert list to Pandas dataframe
+        df = pd.DataFrame(listOut, columns=COLUMNS)
+
+    if args.densityFlag:
+        # Density plot of average encoding Q vs lsm estimate
+        fig, qPlot = plotDensity(df['Qav'].to_numpy(), df['Qlsm'].to_numpy(), args.bins,
+                                 'Qav', 'Qlsm')
+    else:
+        # Scatter plot of average encoding Q vs lsm estimate
+        qPlot = df.plot.scatter(x = 'Qav', y = 'Qlsm', s = 1, color = 'b')
+        fig = qPlot.get_figure()
     # Add 1:1 line
     qPlot.axline([0, 0], [1, 1], linewidth=1, linestyle='dashed', color = 'g')
-    fig = qPlot.get_figure()
     fig.savefig('qav-qlsm.png', dpi=150)
 
-    # Scatter plot of deltaQ vs NSE
-    nsePlot = df.plot.scatter(x = 'deltaQ', y = 'NSE', s = 1, color = 'b', xlabel = '|Qav - Qlsm|', ylabel = 'NSE')
-    fig = nsePlot.get_figure()
+    if args.densityFlag:
+        # Density plot of deltaQ vs NSE
+        fig, _ = plotDensity(df['deltaQ'].to_numpy(), df['NSE'].to_numpy(), args.bins,
+                             '|Qav - Qlsm|', 'NSE')
+    else:
+        # Scatter plot of deltaQ vs NSE
+        nsePlot = df.plot.scatter(x = 'deltaQ', y = 'NSE', s = 1, color = 'b', xlabel = '|Qav - Qlsm|', ylabel = 'NSE')
+        fig = nsePlot.get_figure()
     fig.savefig('deltaq-nse.png', dpi=150)
 
 
@@ -1,9 +1,12 @@
 #!/bin/bash
 
-python3 ./jpeg-quality-demo/plot-goodness-fit.py ./jpeg-quality-demo/images/dbnl/mul-master.jpg -x 30
-python3 ./jpeg-quality-demo/plot-goodness-fit.py ./jpeg-quality-demo/images/dbnl/mul-access.jpg -x 185
-python3 ./jpeg-quality-demo/plot-goodness-fit.py ./jpeg-quality-demo/images/misc/image-177.jpg -x 90
-python3 ./jpeg-quality-demo/plot-goodness-fit.py ./jpeg-quality-demo/images/misc/sample-jpg-files-sample-4.jpg -x 40
-python3 ./jpeg-quality-demo/plot-goodness-fit.py ./jpeg-quality-demo/images/misc/jpeg444.jpg -x 45
-python3 ./jpeg-quality-demo/plot-goodness-fit.py ./jpeg-quality-demo/images/misc/image-98.jpg -x 90
-python3 ./jpeg-quality-demo/plot-goodness-fit.py ./jpeg-quality-demo/images/misc/hopper_16bit_qtables.jpg  -x 280
+# Text annotation positions of each image are in plot-positions.csv
+python3 ./jpeg-quality-demo/plot-goodness-fit.py \
+    --positions ./jpeg-quality-demo/plot-positions.csv \
+    ./jpeg-quality-demo/images/dbnl/mul-master.jpg \
+    ./jpeg-quality-demo/images/dbnl/mul-access.jpg \
+    ./jpeg-quality-demo/images/misc/image-177.jpg \
+    ./jpeg-quality-demo/images/misc/sample-jpg-files-sample-4.jpg \
+    ./jpeg-quality-demo/images/misc/jpeg444.jpg \
+    ./jpeg-quality-demo/images/misc/image-98.jpg \
+    ./jpeg-quality-demo/images/misc/hopper_16bit_qtables.jpg
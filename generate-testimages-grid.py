@@ -0,0 +1,118 @@
+#! /usr/bin/env python3
+
+"""
+Generate test images using separate quality levels for luminance and
+chrominance, for all 10 thousand combinations. Same output as
+generate-testimages-cjpeg.sh, but the source image is only decoded once, and
+all images are encoded in-process with Pillow (using the standard tables for
+each quality level, as cjpeg), spread over a pool of worker processes.
+
+A manifest (manifest.csv) is written to the output directory, with the path
+(relative to the output directory), luminance and chrominance quality and
+quantization table fingerprint of each image.
+"""
+import os
+import argparse
+import csv
+import multiprocessing
+from PIL import Image
+from jpegquality.lsm import getStandardTables
+from jpegquality.cache import fingerprint
+
+# Quality levels of the grid
+QUALITY_LEVELS = range(1, 101)
+
+# Name of manifest file in output directory, and its columns
+MANIFEST_NAME = "manifest.csv"
+MANIFEST_FIELDS = ["path", "qlum", "qchrom", "fingerprint"]
+
+# Source image and output settings of current worker process
+sourceImage = None
+outputSettings = None
+
+def parseCommandLine():
+    """Parse command line"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('imageIn',
+                        action="store",
+                        type=str,
+                        help="input image")
+    parser.add_argument('dirOut',
+                        action="store",
+                        type=str,
+                        help="output directory")
+    parser.add_argument('--workers',
+                        action="store",
+                        type=int,
+                        help="number of worker processes (default: number of CPUs)",
+                        dest="workers",
+                        default=os.cpu_count())
+    # Parse arguments
+    args = parser.parse_args()
+    return args
+
+
+def initWorker(mode, size, data, dirOut, nameBase):
+    """Initialize source image (from raw pixel data) and output settings of
+    current process"""
+    global sourceImage, outputSettings
+    sourceImage = Image.frombytes(mode, size, data)
+    outputSettings = (dirOut, nameBase)
+
+
+def encodeRow(qlum):
+    """Write images for luminance quality qlum and all chrominance quality
+    levels, and return their manifest rows"""
+    dirOut, nameBase = outputSettings
+    rows = []
+    # Tables are not capped at 255, as cjpeg without -baseline
+    lumTable = getStandardTables(qlum, 16)[0]
+    for qchrom in QUALITY_LEVELS:
+        chromTable = getStandardTables(qchrom, 16)[1]
+        nameOut = "{}_l{:03}_c{:03}.jpg".format(nameBase, qlum, qchrom)
+        sourceImage.save(os.path.join(dirOut, nameOut), format='JPEG',
+                         qtables=[lumTable, chromTable], subsampling='4:2:0')
+        rows.append([nameOut, qlum, qchrom, fingerprint({0: lumTable, 1: chromTable})])
+    return rows
+
+
+def encodeAll(initArgs, workers):
+    """Generator that yields manifest rows for each luminance quality level
+    (in order). If workers is greater than 1, the images are written by a
+    pool of worker processes, each initialized with initArgs"""
+    if workers <= 1:
+        initWorker(*initArgs)
+        yield from map(encodeRow, QUALITY_LEVELS)
+        return
+    with multiprocessing.Pool(workers, initializer=initWorker, initargs=initArgs) as pool:
+        yield from pool.imap(encodeRow, QUALITY_LEVELS)
+
+
+def main():
+    args = parseCommandLine()
+    imageIn = args.imageIn
+    dirOut = args.dirOut
+    if not os.path.isdir(dirOut):
+        raise SystemExit("output directory must be a directory")
+    # Base name up to first dot, as generate-testimages-cjpeg.sh
+    nameBase = os.path.basename(imageIn).split('.')[0]
+
+    # Decode source image once; workers get a copy of its pixel data
+    with open(imageIn, 'rb') as fIn:
+        im = Image.open(fIn)
+        im.load()
+        im = im.convert('RGB')
+    initArgs = (im.mode, im.size, im.tobytes(), dirOut, nameBase)
+
+    noImages = 0
+    with open(os.path.join(dirOut, MANIFEST_NAME), 'w', newline='', encoding='utf-8') as fManifest:
+        writer = csv.writer(fManifest)
+        writer.writerow(MANIFEST_FIELDS)
+        for rows in encodeAll(initArgs, args.workers):
+            writer.writerows(rows)
+            noImages += len(rows)
+    print("wrote {} images and {} to {}".format(noImages, MANIFEST_NAME, dirOut))
+
+
+if __name__ == "__main__":
+    main()
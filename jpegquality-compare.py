@@ -4,343 +4,193 @@
 Estimate JPEG quality using ImageMagick heuristic, modified ImageMagick heuristic and
 least squares matching method
 """
-import math
 import argparse
+import collections
 import csv
-from PIL import Image
+import os
+from jpegquality.lsm import CHUNK_SIZE
+from jpegquality.inputs import addInputArguments, checkInputArguments, getInputPaths
+from jpegquality.archives import expandArchives
+from jpegquality.cache import SQLiteCache
+from jpegquality.pipeline import RESULT_FIELDS, scoreAll, readAhead, readCheckpoint, isScored
 
 def parseCommandLine():
     """Parse command line"""
     parser = argparse.ArgumentParser()
-    parser.add_argument('JPEGsIn',
+    addInputArguments(parser)
+    parser.add_argument('--out', '-o',
                         action="store",
                         type=str,
-                        nargs='+',
-                        help="input JPEG(s) (wildcards allowed)")
+                        help="output CSV file (default: jpeg-quality-comparison.csv)",
+                        dest="fileOut",
+                        default="jpeg-quality-comparison.csv")
+    parser.add_argument('--resume',
+                        action="store_true",
+                        help="skip files that were already scored according to checkpoint \
+                        file, and append results to existing output file",
+                        dest="resumeFlag",
+                        default=False)
+    parser.add_argument('--mmap',
+                        action="store_true",
+                        help="read quantization tables from memory-mapped files",
+                        dest="mmapFlag",
+                        default=False)
+    parser.add_argument('--prefix',
+                        action="store",
+                        type=int,
+                        help="read only the first PREFIX KB of each file, and only read more \
+                        if the quantization tables don't fit in it",
+                        dest="prefixKB",
+                        default=None)
     parser.add_argument('--verbose',
                         action="store_true",
                         help="print variable values at each iteration",
                         dest="verboseFlag",
                         default=False)
+    parser.add_argument('--chunksize',
+                        action="store",
+                        type=int,
+                        help="number of files that are scored at once (default: {})".format(CHUNK_SIZE),
+                        dest="chunkSize",
+                        default=CHUNK_SIZE)
+    parser.add_argument('--workers',
+                        action="store",
+                        type=int,
+                        help="number of worker processes (default: 1)",
+                        dest="workers",
+                        default=1)
+    parser.add_argument('--readers',
+                        action="store",
+                        type=int,
+                        help="number of threads that read files ahead of scoring, with up to \
+                        this many reads in flight (default: 0, files are read by the scoring \
+                        processes)",
+                        dest="readers",
+                        default=0)
+    parser.add_argument('--library',
+                        action="append",
+                        type=str,
+                        help="encoder library file (see jpegquality-library.py) that is used \
+                        in addition to the bundled library (can be used more than once)",
+                        dest="libraryFiles",
+                        default=[])
+    parser.add_argument('--cachesize',
+                        action="store",
+                        type=int,
+                        help="maximum number of distinct quantization table sets for which \
+                        results are cached (default: 1000, 0 disables cache)",
+                        dest="cacheSize",
+                        default=1000)
+    parser.add_argument('--cachedb',
+                        action="store",
+                        type=str,
+                        help="SQLite database with persistent cache of results, which is \
+                        shared across runs (created if it doesn't exist)",
+                        dest="cacheDB",
+                        default=None)
+    parser.add_argument('--cachefiles',
+                        action="store_true",
+                        help="also store fingerprint of each file by path, size and \
+                        modification time in cache database, so that unchanged files \
+                        are not opened again",
+                        dest="cacheFilesFlag",
+                        default=False)
     # Parse arguments
     args = parser.parse_args()
+    checkInputArguments(parser, args)
+    if args.chunkSize < 1:
+        parser.error("--chunksize must be at least 1")
+    if args.prefixKB is not None:
+        if args.mmapFlag:
+            parser.error("--mmap and --prefix can't be used together")
+        if args.prefixKB < 1:
+            parser.error("--prefix must be at least 1")
 
     return args
 
 
-def computeJPEGQuality_im_orig(image, verboseFlag):
-    """Returns JPEG quality of a JPEG image based on original ImageMagick
-    algorithm"""
-
-    _HASH_2 = [ 1020, 1015, 932,  848,  780,  735,  702,  679,  660,  645,
-                632,  623,  613,  607,  600,  594,  589,  585,  581,  571,
-                555,  542,  529,  514,  494,  474,  457,  439,  424,  410,
-                397,  386,  373,  364,  351,  341,  334,  324,  317,  309,
-                299,  294,  287,  279,  274,  267,  262,  257,  251,  247,
-                243,  237,  232,  227,  222,  217,  213,  207,  202,  198,
-                192,  188,  183,  177,  173,  168,  163,  157,  153,  148,
-                143,  139,  132,  128,  125,  119,  115,  108,  104,  99,
-                94,   90,   84,   79,   74,   70,   64,   59,   55,   49,
-                45,   40,   34,   30,   25,   20,   15,   11,   6,    4,
-                0 ]
-
-    _SUMS_2 = [ 32640, 32635, 32266, 31495, 30665, 29804, 29146, 28599, 28104,
-                27670, 27225, 26725, 26210, 25716, 25240, 24789, 24373, 23946,
-                23572, 22846, 21801, 20842, 19949, 19121, 18386, 17651, 16998,
-                16349, 15800, 15247, 14783, 14321, 13859, 13535, 13081, 12702,
-                12423, 12056, 11779, 11513, 11135, 10955, 10676, 10392, 10208,
-                9928,  9747,  9564,  9369,  9193,  9017,  8822,  8639,  8458,
-                8270,  8084,  7896,  7710,  7527,  7347,  7156,  6977,  6788,
-                6607,  6422,  6236,  6054,  5867,  5684,  5495,  5305,  5128,
-                4945,  4751,  4638,  4442,  4248,  4065,  3888,  3698,  3509,
-                3326,  3139,  2957,  2775,  2586,  2405,  2216,  2037,  1846,
-                1666,  1483,  1297,  1109,  927,   735,   554,   375,   201,
-                128,   0 ]
-
-    _HASH_1 = [ 510,  505,  422,  380,  355,  338,  326,  318,  311,  305,
-                300,  297,  293,  291,  288,  286,  284,  283,  281,  280,
-                279,  278,  277,  273,  262,  251,  243,  233,  225,  218,
-                211,  205,  198,  193,  186,  181,  177,  172,  168,  164,
-                158,  156,  152,  148,  145,  142,  139,  136,  133,  131,
-                129,  126,  123,  120,  118,  115,  113,  110,  107,  105,
-                102,  100,  97,   94,   92,   89,   87,   83,   81,   79,
-                76,   74,   70,   68,   66,   63,   61,   57,   55,   52,
-                50,   48,   44,   42,   39,   37,   34,   31,   29,   26,
-                24,   21,   18,   16,   13,   11,   8,    6,    3,    2,
-                0 ]
-
-    _SUMS_1 = [ 16320, 16315, 15946, 15277, 14655, 14073, 13623, 13230, 12859,
-                12560, 12240, 11861, 11456, 11081, 10714, 10360, 10027, 9679,
-                9368,  9056,  8680,  8331,  7995,  7668,  7376,  7084,  6823,
-                6562,  6345,  6125,  5939,  5756,  5571,  5421,  5240,  5086,
-                4976,  4829,  4719,  4616,  4463,  4393,  4280,  4166,  4092,
-                3980,  3909,  3835,  3755,  3688,  3621,  3541,  3467,  3396,
-                3323,  3247,  3170,  3096,  3021,  2952,  2874,  2804,  2727,
-                2657,  2583,  2509,  2437,  2362,  2290,  2211,  2136,  2068,
-                1996,  1915,  1858,  1773,  1692,  1620,  1552,  1477,  1398,
-                1326,  1251,  1179,  1109,  1031,  961,   884,   814,   736,
-                667,   592,   518,   441,   369,   292,   221,   151,   86,
-                64,    0 ]
-
-    qsum = 0
-    qdict = image.quantization
-
-    for i, qtable in qdict.items():
-        qsum += sum(qtable)
-
-    if len(qdict) >= 1:
-        qvalue = qdict[0][2]+qdict[0][53]
-        hashes, sums = _HASH_1, _SUMS_1
-        if len(qdict) >= 2:
-            qvalue += qdict[1][0]+qdict[1][-1]
-            hashes, sums = _HASH_2, _SUMS_2
-        for i in range(100):
-            if verboseFlag:
-                print("i: {}, qvalue: {}, hashes[i]:{}, qsum:{}, sums[i]{}".format(i,qvalue, hashes[i], qsum, sums[i]))
-            if ((qvalue < hashes[i]) and (qsum < sums[i])):
-                continue
-            if (((qvalue <= hashes[i]) and (qsum <= sums[i])) or (i >= 50)):
-                return i+1
-            break
-    return -1
-
-
-def computeJPEGQuality_im_mod(image, verboseFlag):
-    """Returns JPEG quality and exactness flag of a JPEG image based on modified ImageMagick
-    algorithm that omits i >= 50 condition"""
-
-    _HASH_2 = [ 1020, 1015, 932,  848,  780,  735,  702,  679,  660,  645,
-                632,  623,  613,  607,  600,  594,  589,  585,  581,  571,
-                555,  542,  529,  514,  494,  474,  457,  439,  424,  410,
-                397,  386,  373,  364,  351,  341,  334,  324,  317,  309,
-                299,  294,  287,  279,  274,  267,  262,  257,  251,  247,
-                243,  237,  232,  227,  222,  217,  213,  207,  202,  198,
-                192,  188,  183,  177,  173,  168,  163,  157,  153,  148,
-                143,  139,  132,  128,  125,  119,  115,  108,  104,  99,
-                94,   90,   84,   79,   74,   70,   64,   59,   55,   49,
-                45,   40,   34,   30,   25,   20,   15,   11,   6,    4,
-                0 ]
-
-    _SUMS_2 = [ 32640, 32635, 32266, 31495, 30665, 29804, 29146, 28599, 28104,
-                27670, 27225, 26725, 26210, 25716, 25240, 24789, 24373, 23946,
-                23572, 22846, 21801, 20842, 19949, 19121, 18386, 17651, 16998,
-                16349, 15800, 15247, 14783, 14321, 13859, 13535, 13081, 12702,
-                12423, 12056, 11779, 11513, 11135, 10955, 10676, 10392, 10208,
-                9928,  9747,  9564,  9369,  9193,  9017,  8822,  8639,  8458,
-                8270,  8084,  7896,  7710,  7527,  7347,  7156,  6977,  6788,
-                6607,  6422,  6236,  6054,  5867,  5684,  5495,  5305,  5128,
-                4945,  4751,  4638,  4442,  4248,  4065,  3888,  3698,  3509,
-                3326,  3139,  2957,  2775,  2586,  2405,  2216,  2037,  1846,
-                1666,  1483,  1297,  1109,  927,   735,   554,   375,   201,
-                128,   0 ]
-
-    _HASH_1 = [ 510,  505,  422,  380,  355,  338,  326,  318,  311,  305,
-                300,  297,  293,  291,  288,  286,  284,  283,  281,  280,
-                279,  278,  277,  273,  262,  251,  243,  233,  225,  218,
-                211,  205,  198,  193,  186,  181,  177,  172,  168,  164,
-                158,  156,  152,  148,  145,  142,  139,  136,  133,  131,
-                129,  126,  123,  120,  118,  115,  113,  110,  107,  105,
-                102,  100,  97,   94,   92,   89,   87,   83,   81,   79,
-                76,   74,   70,   68,   66,   63,   61,   57,   55,   52,
-                50,   48,   44,   42,   39,   37,   34,   31,   29,   26,
-                24,   21,   18,   16,   13,   11,   8,    6,    3,    2,
-                0 ]
-
-    _SUMS_1 = [ 16320, 16315, 15946, 15277, 14655, 14073, 13623, 13230, 12859,
-                12560, 12240, 11861, 11456, 11081, 10714, 10360, 10027, 9679,
-                9368,  9056,  8680,  8331,  7995,  7668,  7376,  7084,  6823,
-                6562,  6345,  6125,  5939,  5756,  5571,  5421,  5240,  5086,
-                4976,  4829,  4719,  4616,  4463,  4393,  4280,  4166,  4092,
-                3980,  3909,  3835,  3755,  3688,  3621,  3541,  3467,  3396,
-                3323,  3247,  3170,  3096,  3021,  2952,  2874,  2804,  2727,
-                2657,  2583,  2509,  2437,  2362,  2290,  2211,  2136,  2068,
-                1996,  1915,  1858,  1773,  1692,  1620,  1552,  1477,  1398,
-                1326,  1251,  1179,  1109,  1031,  961,   884,   814,   736,
-                667,   592,   518,   441,   369,   292,   221,   151,   86,
-                64,    0 ]
-
-    qsum = 0
-    qdict = image.quantization
-
-    for i, qtable in qdict.items():
-        qsum += sum(qtable)
-
-    if len(qdict) >= 1:
-        qvalue = qdict[0][2]+qdict[0][53]
-        hashes, sums = _HASH_1, _SUMS_1
-        if len(qdict) >= 2:
-            qvalue += qdict[1][0]+qdict[1][-1]
-            hashes, sums = _HASH_2, _SUMS_2
-        for i in range(100):
-            if verboseFlag:
-                print("i: {}, qvalue: {}, hashes[i]:{}, qsum:{}, sums[i]{}".format(i, qvalue, hashes[i], qsum, sums[i]))
-            if ((qvalue < hashes[i]) and (qsum < sums[i])):
-                continue
-            else:
-                quality= i+1
-                exact = qsum <= sums[i]
-                return quality, exact
-            break
-    return -1, False
-
-
-def computeJPEGQuality_lsm(image):
-    """Estimates JPEG quality using least squares matching between image
-    quantization tables and standard tables from the JPEG ISO standard.
-    
-    This compares the image quantization tables against the standard quantization
-    tables for *all* possible quality levels, which are generated using
-    Equations 1 and 2 in Kornblum (2008):
-
-    https://www.sciencedirect.com/science/article/pii/S1742287608000285
-
-    Returns quality estimate, root mean squared error of residuals between
-    image quantization coefficients and corresponding standard coefficients,
-    and Nash-Sutcliffe Efficiency measure.
-    """
-
-    # Standard JPEG luminance and chrominance quantization tables
-    # for 50% quality (ISO/IEC 10918-1 : 1993(E)), Annex K)
-    lum_base = [16, 11, 10, 16, 24, 40, 51, 61,
-                12, 12, 14, 19, 26, 58, 60, 55,
-                14, 13, 16, 24, 40, 57, 69, 56,
-                14, 17, 22, 29, 51, 87, 80, 62,
-                18, 22, 37, 56, 68, 109, 103, 77,
-                24, 35, 55, 64, 81, 104, 113, 92,
-                49, 64, 78, 87, 103, 121, 120, 101,
-                72, 92, 95, 98, 112, 100, 103, 99]
-
-    chrom_base = [17, 18, 24, 47, 99, 99, 99, 99,
-                  18, 21, 26, 66, 99, 99, 99, 99,
-                  24, 26, 56, 99, 99, 99, 99, 99,
-                  47, 66, 99, 99, 99, 99, 99, 99,
-                  99, 99, 99, 99, 99, 99, 99, 99,
-                  99, 99, 99, 99, 99, 99, 99, 99,
-                  99, 99, 99, 99, 99, 99, 99, 99,
-                  99, 99, 99, 99, 99, 99, 99, 99]
-
-    # Image quantization tables
-    qdict = image.quantization
-    noTables = len(qdict)
-
-    # Default quantization table bit depth
-    qBitDepth = 8
-
-    if max(qdict[0]) > 255:
-        # Any values greater than 255 indicate bir depth 16 
-        qBitDepth = 16
-    if noTables >= 2:
-        if max(qdict[1]) > 255:
-            qBitDepth = 16
-
-    # Calculate mean of all value in quantization tables
-    Tsum = sum(qdict[0])
-    if noTables >= 2:
-        Tsum += sum(qdict[1])
-    Tmean = Tsum / (noTables*64)
-
-    # List for storing squared error values
-    errors = []
-
-    # List for storing Nash–Sutcliffe Efficiency values
-    nseVals = []
-
-    # Iterate over all quality levels
-    for i in range(100):
-        # Quality level
-        Q = i+1
-        # Scaling factor (Eq 1 in Kornblum, 2008)
-        if Q < 50:
-            S = 5000/Q
-        else:
-            S = 200 - 2*Q
-
-        # Initialize sum of squared differences between image quantization values
-        # and corresponding values from standard q tables for this quality level
-        sumSqErrors = 0
-
-        # Initialize sum of squared differences between image quantization values
-        # and mean image quantization value (needed to calculate Nash Efficiency)
-        sumSqMean = 0
-
-        # Iterate over all values in quantization tables for this quality
-        for j in range(64):
-            # Compute standard luminance table value from scaling factor
-            # (Eq 2 in Kornblum, 2008)
-            Tslum = max(math.floor((S*lum_base[j] + 50) / 100), 1)
-            # Cap Tslum at 255 if bit depth is 8
-            if qBitDepth == 8:
-                Tslum = min(Tslum, 255)
-            # Update sum of squared errors relative to corresponding
-            # image table value
-            sumSqErrors += (qdict[0][j] - Tslum)**2
-
-            # Sum of luminance and chrominance values          
-            Tcombi = qdict[0][j]
-
-            if noTables >= 2:
-                # Compute standard chrominance table value from scaling factor
-                # (Eq 2 in Kornblum, 2008)
-                Tschrom = max(math.floor((S*chrom_base[j] + 50) / 100), 1)
-                # Cap Tschrom at 255 if bit depth is 8
-                if qBitDepth == 8:
-                    Tschrom = min(Tschrom, 255)
-                # Update sum of squared errors relative to corresponding
-                # image table value
-                sumSqErrors  += (qdict[1][j] - Tschrom)**2
-
-                # Update sum of luminance and chrominance values
-                Tcombi += qdict[1][j]
-   
-            # Update sumSqMMean
-            sumSqMean += (Tcombi - Tmean)**2
-
-            j += 1
-
-        # Calculate Nash-Sutcliffe Effiency
-        nse = 1 - sumSqErrors/sumSqMean
-
-        # Add calculated statistics to lists
-        errors.append(sumSqErrors)
-        nseVals.append(nse)
-
-    # Quality is estimated as level with smallest sum of squared errors
-    # Note that this will return the smallest quality level in case
-    # the smallest SSE occurs for more than one level!
-    # TODO: perhaps add a check for this and report as output?
-    qualityEst = errors.index(min(errors)) + 1
-    # Corresponding SSE. Value 0 indicates exact match with standard JPEG
-    # quantization tables. Any other value means non-standard tables were
-    # used, and quality estimate is an approximation
-    sumSqErrors = min(errors)
-    # Compute corresponding root mean squared error
-    rmsError = round(math.sqrt(sumSqErrors / (noTables * 64)), 3)
-    nse = round(max(nseVals), 3)
-    return qualityEst, rmsError, nse
-
-
 def main():
     args = parseCommandLine()
-    myJPEGs =  args.JPEGsIn
-    myJPEGs.sort()
+    # JPEGs inside ZIP and TAR archives are scored without extracting them
+    myJPEGs = expandArchives(getInputPaths(args))
     verboseFlag = args.verboseFlag
-    fileOut = "jpeg-quality-comparison.csv"
-    resultList = [["file", "q_im_orig", "q_im_mod",
-                  "exact_im_mod", "q_lsm", "rmse_lsm", "nse_lsm"]]
-
-    for JPEG in myJPEGs:
-        with open(JPEG, 'rb') as fIn:
-            im = Image.open(fIn)
-            im.load()
-            q_im_orig = computeJPEGQuality_im_orig(im, verboseFlag)
-            q_im_mod, exact_im_mod = computeJPEGQuality_im_mod(im, verboseFlag)
-            q_lsm, rmse_lsm, nse_lsm = computeJPEGQuality_lsm(im)
-            resultList.append([JPEG, q_im_orig, q_im_mod, exact_im_mod,
-                               q_lsm, rmse_lsm, nse_lsm])
-
-    with open(fileOut, 'w', newline='', encoding='utf-8') as csvfile:
+    chunkSize = args.chunkSize
+    workers = args.workers
+    readers = args.readers
+    cacheSize = args.cacheSize
+    cacheDB = args.cacheDB
+    cacheFilesFlag = args.cacheFilesFlag
+    readMethod = "mmap" if args.mmapFlag else "stream"
+    prefixSize = None
+    if args.prefixKB is not None:
+        readMethod = "prefix"
+        prefixSize = 1024*args.prefixKB
+    # Statistics of the prefix reader
+    readStats = collections.Counter()
+    fileOut = args.fileOut
+    resumeFlag = args.resumeFlag
+    # Checkpoint file with path, size and modification time of scored files
+    checkpointFile = fileOut + ".checkpoint"
+    header = ["file", *RESULT_FIELDS, "error"]
+
+    mode = 'w'
+    if resumeFlag and os.path.isfile(fileOut) and os.path.isfile(checkpointFile):
+        # Skip files that were already scored by a previous run, and append
+        # results of remaining files to existing output
+        scored = readCheckpoint(checkpointFile)
+        myJPEGs = (JPEG for JPEG in myJPEGs if not isScored(JPEG, scored))
+        mode = 'a'
+
+    if readers > 0:
+        # Read files concurrently in this process, and pass their tables on
+        # to the scoring stage. If the file cache is used, reader threads
+        # read from the file cache as well, so that files whose results are
+        # cached are not opened
+        myJPEGs = readAhead(myJPEGs, readers, readMethod, prefixSize, readStats,
+                            cacheDB if cacheFilesFlag else None)
+
+    with open(fileOut, mode, newline='', encoding='utf-8') as csvfile, \
+         open(checkpointFile, mode, newline='', encoding='utf-8') as cpfile:
         writer = csv.writer(csvfile)
-        writer.writerows(resultList)
+        cpWriter = csv.writer(cpfile)
+        if mode == 'w':
+            writer.writerow(header)
+        # Read and score files in chunks, and write the results of each
+        # chunk as soon as they are available. This keeps memory use
+        # constant, and leaves partial results on disk if the run is
+        # interrupted. Files are only added to the checkpoint after their
+        # results are written
+        hits = misses = noScored = 0
+        # New entries are only written to the persistent cache from this
+        # process; workers only read from it
+        writeDB = None
+        if cacheDB is not None:
+            writeDB = SQLiteCache(cacheDB)
+        workerArgs = (cacheSize, cacheDB, cacheFilesFlag, readMethod, prefixSize,
+                      tuple(args.libraryFiles))
+        for chunk in scoreAll(myJPEGs, verboseFlag, chunkSize, workers, workerArgs):
+            writer.writerows(chunk["rows"])
+            csvfile.flush()
+            cpWriter.writerows(chunk["fileStats"])
+            cpfile.flush()
+            if writeDB is not None:
+                writeDB.putResults(chunk["newResults"])
+                if cacheFilesFlag:
+                    writeDB.putFingerprints(chunk["newFingerprints"])
+            hits += chunk["hits"]
+            misses += chunk["misses"]
+            noScored += chunk["scored"]
+            readStats.update(chunk["readStats"])
+        if writeDB is not None:
+            writeDB.close()
+
+    print("result cache: {} hits, {} misses; {} distinct table sets scored".format(hits, misses,
+                                                                               noScored))
+    if readMethod == "prefix" and readStats["files"] > 0:
+        print("prefix reads: {} files, {} needed more than {} KB ({:.1f}%), "
+              "{} bytes read".format(readStats["files"], readStats["extended"], args.prefixKB,
+                                     100*readStats["extended"] / readStats["files"],
+                                     readStats["bytes"]))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+
+"""
+Add quantization tables of reference JPEGs from a known encoder and setting
+to an encoder library file (see jpegquality/encoders.py). Table sets that are
+already in the library are skipped.
+"""
+import argparse
+import os
+from jpegquality import readQuantizationTables
+from jpegquality.inputs import addInputArguments, checkInputArguments, getInputPaths
+from jpegquality.lsm import packTables
+from jpegquality.encoders import readLibrary, writeLibrary
+
+def parseCommandLine():
+    """Parse command line"""
+    parser = argparse.ArgumentParser()
+    addInputArguments(parser)
+    parser.add_argument('--library', '-l',
+                        action="store",
+                        type=str,
+                        required=True,
+                        help="library file (created if it doesn't exist)",
+                        dest="libraryFile")
+    parser.add_argument('--encoder', '-e',
+                        action="store",
+                        type=str,
+                        required=True,
+                        help="name of encoder (e.g. software or camera model)",
+                        dest="encoder")
+    parser.add_argument('--setting', '-s',
+                        action="store",
+                        type=str,
+                        help="encoder setting (e.g. quality level)",
+                        dest="setting",
+                        default="")
+
+    # Parse arguments
+    args = parser.parse_args()
+    checkInputArguments(parser, args)
+
+    return args
+
+
+def main():
+    args = parseCommandLine()
+    myJPEGs = getInputPaths(args)
+    libraryFile = args.libraryFile
+
+    entries = []
+    if os.path.isfile(libraryFile):
+        entries = readLibrary(libraryFile)
+    known = {packTables(dict(enumerate(entry["tables"]))) for entry in entries}
+
+    for JPEG in myJPEGs:
+        with open(JPEG, 'rb') as fIn:
+            qdict = readQuantizationTables(fIn)
+        # Only the luminance and chrominance tables are used for matching
+        tables = [qdict[tableId] for tableId in (0, 1) if tableId in qdict]
+        key = packTables(dict(enumerate(tables)))
+        if key in known:
+            print("skipping {} (tables already in library)".format(JPEG))
+            continue
+        known.add(key)
+        entries.append({"encoder": args.encoder,
+                        "setting": args.setting,
+                        "source": os.path.basename(JPEG),
+                        "tables": tables})
+        print("added {}".format(JPEG))
+
+    writeLibrary(entries, libraryFile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""
+Shared code for the JPEG quality estimation scripts in this repository.
+
+- qtables: reading quantization tables from the JPEG header
+- lsm: least squares matching against the standard quantization tables
+- imagemagick: original and modified ImageMagick heuristics
+- cache: caching of results by quantization table fingerprint
+- pipeline: chunked and parallel scoring of many files with all methods
+- inputs: input file arguments of the scripts
+- archives: reading quantization tables of JPEGs inside ZIP and TAR archives
+- encoders: matching against a library of tables of known encoders
+"""
+from .qtables import readQuantizationTables
+from .lsm import (LUM_BASE, CHROM_BASE, STANDARD_TABLES, getStandardTables,
+                  computeJPEGQuality_lsm, computeJPEGQuality_lsm_ties,
+                  computeJPEGQuality_lsm_batch, stackTables)
+from .imagemagick import (computeJPEGQuality_im_orig, computeJPEGQuality_im_mod,
+                          computeJPEGQuality_im_batch)
+from .cache import fingerprint
+
+__all__ = ["readQuantizationTables",
+           "LUM_BASE", "CHROM_BASE", "STANDARD_TABLES", "getStandardTables",
+           "computeJPEGQuality_lsm", "computeJPEGQuality_lsm_ties",
+           "computeJPEGQuality_lsm_batch", "stackTables",
+           "computeJPEGQuality_im_orig", "computeJPEGQuality_im_mod",
+           "computeJPEGQuality_im_batch", "fingerprint"]
@@ -0,0 +1,115 @@
+"""
+Read quantization tables of JPEGs inside ZIP and TAR archives, without
+extracting them.
+
+Only the header bytes of each member are read (up to the first SOS marker).
+ZIP members are read in the order of their offsets in the central directory,
+and TAR archives are read sequentially, so that each archive is read in a
+single forward pass.
+
+Members are identified by the archive path and the member name, separated
+by ARCHIVE_SEPARATOR (e.g. "delivery.zip!scans/0001.jpg").
+"""
+import os
+import tarfile
+import time
+import zipfile
+import zlib
+from .qtables import readQuantizationTables
+from .inputs import JPEG_EXTENSIONS, InputTables, InputError, READ_ERRORS, getErrorMessage
+
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+ARCHIVE_SEPARATOR = "!"
+
+# Exceptions that are raised by reading a member that can't be read (in
+# addition to those of files), or an archive that can't be read. ZipFile
+# raises RuntimeError for encrypted members, and NotImplementedError for
+# unsupported compression methods
+MEMBER_ERRORS = READ_ERRORS + (EOFError, zlib.error, zipfile.BadZipFile, tarfile.TarError,
+                               RuntimeError, NotImplementedError)
+
+def isArchive(path):
+    """Returns True if path has a ZIP or TAR extension"""
+    return path.lower().endswith(ZIP_EXTENSIONS + TAR_EXTENSIONS)
+
+
+def readZip(archivePath, extensions):
+    """Generator that yields InputTables (or InputError if it can't be read)
+    for all members of ZIP archive with one of extensions"""
+    with zipfile.ZipFile(archivePath) as archive:
+        # The central directory gives the offset of each member, so the
+        # members can be read in order of their position in the file
+        members = sorted(archive.infolist(), key=lambda info: info.header_offset)
+        for info in members:
+            if info.is_dir() or not info.filename.lower().endswith(extensions):
+                continue
+            name = archivePath + ARCHIVE_SEPARATOR + info.filename
+            mtime = int(time.mktime(info.date_time + (0, 0, -1))) * 10**9
+            try:
+                with archive.open(info) as fIn:
+                    qdict = readQuantizationTables(fIn)
+            except MEMBER_ERRORS as e:
+                yield InputError(name, info.file_size, mtime, getErrorMessage(e))
+            else:
+                yield InputTables(name, info.file_size, mtime, qdict)
+
+
+def readTar(archivePath, extensions):
+    """Generator that yields InputTables (or InputError if it can't be read)
+    for all members of (optionally compressed) TAR archive with one of
+    extensions"""
+    with tarfile.open(archivePath, 'r:*') as archive:
+        # Iterating over the archive reads the member headers one by one,
+        # skipping over member data that isn't read
+        for member in archive:
+            # TarFile keeps every member header it has read in its members
+            # list (for random access, which isn't used here), so this list
+            # would grow with the size of the archive. It is cleared for all
+            # members (not only JPEGs), which iteration allows, since it
+            # only reads the next header from the archive once the index
+            # passes the end of the list
+            archive.members = []
+            if not member.isfile() or not member.name.lower().endswith(extensions):
+                continue
+            name = archivePath + ARCHIVE_SEPARATOR + member.name
+            mtime = int(member.mtime) * 10**9
+            try:
+                with archive.extractfile(member) as fIn:
+                    qdict = readQuantizationTables(fIn)
+            except MEMBER_ERRORS as e:
+                yield InputError(name, member.size, mtime, getErrorMessage(e))
+            else:
+                yield InputTables(name, member.size, mtime, qdict)
+
+
+def readArchive(archivePath, extensions=JPEG_EXTENSIONS):
+    """Generator that yields InputTables (or InputError) for all members of
+    ZIP or TAR archive with one of extensions. If the archive itself can't
+    be opened or read, an InputError for the archive path is yielded after
+    the members that were read until then"""
+    try:
+        if archivePath.lower().endswith(ZIP_EXTENSIONS):
+            yield from readZip(archivePath, extensions)
+        else:
+            yield from readTar(archivePath, extensions)
+    except MEMBER_ERRORS as e:
+        size = mtime = None
+        try:
+            archiveStat = os.stat(archivePath)
+            size = archiveStat.st_size
+            mtime = archiveStat.st_mtime_ns
+        except OSError:
+            pass
+        yield InputError(archivePath, size, mtime, getErrorMessage(e))
+
+
+def expandArchives(paths):
+    """Generator that yields all paths, except archives, which are replaced
+    by InputTables (or InputError) for all JPEGs inside them"""
+    for path in paths:
+        if isArchive(path):
+            yield from readArchive(path)
+        else:
+            yield path
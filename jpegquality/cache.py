@@ -0,0 +1,117 @@
+"""
+Caching of quality estimates by quantization table fingerprint.
+
+Many files share identical quantization tables (same scanner, same encoder
+settings), and all quality estimates only depend on these tables. Results
+can therefore be cached by a fingerprint of the tables, so that the
+estimators only need to run once for each distinct set of tables.
+
+Results can be cached in memory (ResultCache), and persistently in an SQLite
+database (SQLiteCache) that is shared across runs. The database can also hold
+the fingerprint of each file by path, size and modification time, so that
+unchanged files don't need to be opened at all.
+"""
+import hashlib
+import json
+import sqlite3
+import struct
+from collections import OrderedDict
+
+
+def fingerprint(qdict):
+    """Returns fingerprint (hex digest) of quantization table dictionary.
+    All tables are included, in order of table identifier"""
+    h = hashlib.blake2b(digest_size=16)
+    for tableId in sorted(qdict):
+        h.update(struct.pack('>B64H', tableId, *qdict[tableId]))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Least recently used cache of results, with a maximum number of
+    entries (no caching if maxSize is 0). Keeps count of the number of
+    cache hits and misses"""
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Returns cached result for key, or None if key is not in cache"""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """Add result for key, and evict least recently used entry if cache
+        is full"""
+        if self.maxSize <= 0:
+            return
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+
+class SQLiteCache:
+    """Persistent cache of results by quantization table fingerprint, and of
+    fingerprints by file path, size and modification time, in an SQLite
+    database. Results are stored as JSON objects"""
+
+    def __init__(self, dbFile):
+        self.connection = sqlite3.connect(dbFile)
+        # Write-ahead logging allows concurrent readers while one process
+        # writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS results
+                                   (fingerprint TEXT PRIMARY KEY,
+                                    result TEXT NOT NULL)""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS files
+                                   (path TEXT PRIMARY KEY,
+                                    size INTEGER NOT NULL,
+                                    mtime INTEGER NOT NULL,
+                                    fingerprint TEXT NOT NULL)""")
+        self.connection.commit()
+
+    def close(self):
+        """Close database connection"""
+        self.connection.close()
+
+    def getResult(self, key):
+        """Returns cached result for fingerprint, or None if it is not in
+        the database"""
+        row = self.connection.execute("SELECT result FROM results WHERE fingerprint = ?",
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def getFingerprint(self, path, size, mtime):
+        """Returns fingerprint of file, or None if file is not in the
+        database, or if its size or modification time changed"""
+        row = self.connection.execute("SELECT size, mtime, fingerprint FROM files WHERE path = ?",
+                                      (path,)).fetchone()
+        if row is None or row[0] != size or row[1] != mtime:
+            return None
+        return row[2]
+
+    def putResults(self, results):
+        """Add results from dictionary indexed by fingerprint, and commit"""
+        self.connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?)",
+                                    [(key, json.dumps(result)) for key, result in results.items()])
+        self.connection.commit()
+
+    def putFingerprints(self, entries):
+        """Add list of (path, size, modification time, fingerprint) entries,
+        and commit"""
+        self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                    entries)
+        self.connection.commit()
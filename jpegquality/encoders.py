@@ -0,0 +1,120 @@
+"""
+Matching of quantization tables against a library of tables of known
+encoders (e.g. image editors and camera firmware), many of which don't use
+the standard tables.
+
+A library is a JSON file with a list of entries, each with the name of the
+encoder, its setting, the file the tables were taken from, and the tables
+(luminance, and optionally chrominance, in natural order). A small library is
+bundled with this package (encoders.json), and it is always complemented with
+the standard (IJG) tables for all quality levels. Entries from other library
+files come first, so that they take precedence in case of identical tables.
+
+Each image is matched to the entry with the smallest sum of squared errors
+(i.e. its nearest neighbour). Tables that are identical to an entry are
+found with a single lookup; all others are matched against all entries at
+once, with one matrix product for all images in a chunk.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+from .lsm import STANDARD_TABLES, QUALITIES, stackTables, packTables
+
+# Bundled library
+LIBRARY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "encoders.json")
+
+# Name of the encoder of the standard tables
+IJG_ENCODER = "IJG libjpeg"
+
+
+def readLibrary(libraryFile):
+    """Returns list of entries (dictionaries) from library file"""
+    with open(libraryFile, 'r', encoding='utf-8') as fIn:
+        return json.load(fIn)
+
+
+def writeLibrary(entries, libraryFile):
+    """Write list of entries to library file, with one entry per line"""
+    with open(libraryFile, 'w', encoding='utf-8') as fOut:
+        fOut.write("[\n")
+        fOut.write(",\n".join(json.dumps(entry) for entry in entries))
+        fOut.write("\n]\n")
+
+
+def getStandardEntries():
+    """Returns list of library entries with the standard tables for all
+    quality levels (and the uncapped 16 bit tables where they differ)"""
+    entries = []
+    for bitDepth, tables in STANDARD_TABLES.items():
+        for quality, row in zip(QUALITIES.tolist(), tables):
+            if bitDepth == 16 and row.max() <= 255:
+                continue
+            entries.append({"encoder": IJG_ENCODER,
+                            "setting": str(quality),
+                            "source": "",
+                            "tables": [row[:64].tolist(), row[64:].tolist()]})
+    return entries
+
+
+class EncoderLibrary:
+    """Library of quantization tables of known encoders, for nearest
+    neighbour matching"""
+
+    def __init__(self, entries):
+        self.labels = [(entry["encoder"], entry["setting"]) for entry in entries]
+        qdicts = [dict(enumerate(entry["tables"])) for entry in entries]
+        self.tables, noTables = stackTables(qdicts)
+        self.lumNorms = (self.tables[:, :64]**2).sum(axis=1)
+        self.chromNorms = (self.tables[:, 64:]**2).sum(axis=1)
+        # Index of first entry with each table set, for exact matches
+        self.index = {}
+        for i, qdict in enumerate(qdicts):
+            self.index.setdefault(packTables(qdict), i)
+        # Identifier of library contents, for validating cached results
+        self.id = hashlib.blake2b(json.dumps(entries, sort_keys=True).encode('utf-8'),
+                                  digest_size=8).hexdigest()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def match(self, qdicts):
+        """Returns list with (encoder, setting, root mean squared error) of
+        nearest entry for each quantization table dictionary in qdicts. Only
+        the luminance and chrominance tables are used"""
+        matches = [None]*len(qdicts)
+        rows = []
+        for i, qdict in enumerate(qdicts):
+            entry = self.index.get(packTables(qdict))
+            if entry is None:
+                rows.append(i)
+            else:
+                matches[i] = (*self.labels[entry], 0.0)
+
+        if rows:
+            T, noTables = stackTables([qdicts[i] for i in rows])
+            hasChrom = noTables >= 2
+            # Sum of squared errors for each image and entry, using
+            # ||T - L||^2 = ||T||^2 - 2 T.L + ||L||^2 (chrominance values are
+            # 0 in T for images with one table, so they don't contribute to
+            # T.L)
+            errors = ((T**2).sum(axis=1)[:, np.newaxis]
+                      - 2*T @ self.tables.T
+                      + self.lumNorms
+                      + np.outer(hasChrom, self.chromNorms))
+            nearest = errors.argmin(axis=1)
+            sumSqErrors = np.maximum(errors[np.arange(len(rows)), nearest], 0)
+            rmsErrors = np.sqrt(sumSqErrors / (np.minimum(noTables, 2)*64))
+            for i, entry, rmsError in zip(rows, nearest.tolist(), rmsErrors.tolist()):
+                matches[i] = (*self.labels[entry], rmsError)
+        return matches
+
+
+def getLibrary(libraryFiles=()):
+    """Returns EncoderLibrary with entries from libraryFiles, followed by the
+    bundled library and the standard tables"""
+    entries = []
+    for libraryFile in (*libraryFiles, LIBRARY_FILE):
+        entries += readLibrary(libraryFile)
+    entries += getStandardEntries()
+    return EncoderLibrary(entries)
@@ -0,0 +1,183 @@
+"""
+JPEG quality estimation following ImageMagick's heuristic algorithm, and a
+modified version of it.
+
+Adapted from Edward O's Python port:
+
+https://gist.github.com/eddy-geek/c0f01dc5401dc50a49a0a821cdc9b3e8#file-jpg_quality_pil_magick-py
+
+Which is in turn based on the original ImageMagick code:
+
+https://github.com/ImageMagick/ImageMagick/blob/7.1.0-57/coders/jpeg.c#L782
+
+See also https://stackoverflow.com/questions/4354543/
+
+Both the hash and sum tables below are strictly decreasing, so the first
+quality level at which the loop in ImageMagick's algorithm stops can be found
+with a binary search instead of a linear scan.
+"""
+import bisect
+import numpy as np
+
+# Hash and sum values by quality level, for images with 2 tables (_HASH_2,
+# _SUMS_2) and 1 table (_HASH_1, _SUMS_1)
+_HASH_2 = ( 1020, 1015, 932,  848,  780,  735,  702,  679,  660,  645,
+            632,  623,  613,  607,  600,  594,  589,  585,  581,  571,
+            555,  542,  529,  514,  494,  474,  457,  439,  424,  410,
+            397,  386,  373,  364,  351,  341,  334,  324,  317,  309,
+            299,  294,  287,  279,  274,  267,  262,  257,  251,  247,
+            243,  237,  232,  227,  222,  217,  213,  207,  202,  198,
+            192,  188,  183,  177,  173,  168,  163,  157,  153,  148,
+            143,  139,  132,  128,  125,  119,  115,  108,  104,  99,
+            94,   90,   84,   79,   74,   70,   64,   59,   55,   49,
+            45,   40,   34,   30,   25,   20,   15,   11,   6,    4,
+            0 )
+
+_SUMS_2 = ( 32640, 32635, 32266, 31495, 30665, 29804, 29146, 28599, 28104,
+            27670, 27225, 26725, 26210, 25716, 25240, 24789, 24373, 23946,
+            23572, 22846, 21801, 20842, 19949, 19121, 18386, 17651, 16998,
+            16349, 15800, 15247, 14783, 14321, 13859, 13535, 13081, 12702,
+            12423, 12056, 11779, 11513, 11135, 10955, 10676, 10392, 10208,
+            9928,  9747,  9564,  9369,  9193,  9017,  8822,  8639,  8458,
+            8270,  8084,  7896,  7710,  7527,  7347,  7156,  6977,  6788,
+            6607,  6422,  6236,  6054,  5867,  5684,  5495,  5305,  5128,
+            4945,  4751,  4638,  4442,  4248,  4065,  3888,  3698,  3509,
+            3326,  3139,  2957,  2775,  2586,  2405,  2216,  2037,  1846,
+            1666,  1483,  1297,  1109,  927,   735,   554,   375,   201,
+            128,   0 )
+
+_HASH_1 = ( 510,  505,  422,  380,  355,  338,  326,  318,  311,  305,
+            300,  297,  293,  291,  288,  286,  284,  283,  281,  280,
+            279,  278,  277,  273,  262,  251,  243,  233,  225,  218,
+            211,  205,  198,  193,  186,  181,  177,  172,  168,  164,
+            158,  156,  152,  148,  145,  142,  139,  136,  133,  131,
+            129,  126,  123,  120,  118,  115,  113,  110,  107,  105,
+            102,  100,  97,   94,   92,   89,   87,   83,   81,   79,
+            76,   74,   70,   68,   66,   63,   61,   57,   55,   52,
+            50,   48,   44,   42,   39,   37,   34,   31,   29,   26,
+            24,   21,   18,   16,   13,   11,   8,    6,    3,    2,
+            0 )
+
+_SUMS_1 = ( 16320, 16315, 15946, 15277, 14655, 14073, 13623, 13230, 12859,
+            12560, 12240, 11861, 11456, 11081, 10714, 10360, 10027, 9679,
+            9368,  9056,  8680,  8331,  7995,  7668,  7376,  7084,  6823,
+            6562,  6345,  6125,  5939,  5756,  5571,  5421,  5240,  5086,
+            4976,  4829,  4719,  4616,  4463,  4393,  4280,  4166,  4092,
+            3980,  3909,  3835,  3755,  3688,  3621,  3541,  3467,  3396,
+            3323,  3247,  3170,  3096,  3021,  2952,  2874,  2804,  2727,
+            2657,  2583,  2509,  2437,  2362,  2290,  2211,  2136,  2068,
+            1996,  1915,  1858,  1773,  1692,  1620,  1552,  1477,  1398,
+            1326,  1251,  1179,  1109,  1031,  961,   884,   814,   736,
+            667,   592,   518,   441,   369,   292,   221,   151,   86,
+            64,    0 )
+
+
+# Negated tables (first 100 values only), which are increasing and can be
+# searched with bisect and numpy.searchsorted
+_NEG_HASH_2 = tuple(-h for h in _HASH_2[:100])
+_NEG_SUMS_2 = tuple(-s for s in _SUMS_2[:100])
+_NEG_HASH_1 = tuple(-h for h in _HASH_1[:100])
+_NEG_SUMS_1 = tuple(-s for s in _SUMS_1[:100])
+
+
+def getHashValues(qdict):
+    """Returns qvalue and qsum of quantization table dictionary, and flag
+    that is True if there are 2 or more tables"""
+    qsum = 0
+    for i, qtable in qdict.items():
+        qsum += sum(qtable)
+    qvalue = qdict[0][2]+qdict[0][53]
+    twoTables = len(qdict) >= 2
+    if twoTables:
+        qvalue += qdict[1][0]+qdict[1][-1]
+    return qvalue, qsum, twoTables
+
+
+def findStopIndex(qvalue, qsum, twoTables):
+    """Returns first index i (0-99) for which the condition
+    (qvalue < hashes[i]) and (qsum < sums[i]) doesn't hold, or 100 if it
+    holds for all indices"""
+    if twoTables:
+        negHashes, negSums = _NEG_HASH_2, _NEG_SUMS_2
+    else:
+        negHashes, negSums = _NEG_HASH_1, _NEG_SUMS_1
+    # First index where hashes[i] <= qvalue, and first index where
+    # sums[i] <= qsum
+    return min(bisect.bisect_left(negHashes, -qvalue),
+               bisect.bisect_left(negSums, -qsum))
+
+
+def printIterations(qvalue, qsum, twoTables, iStop):
+    """Print values of all variables at each iteration of the original
+    linear search, up to (and including) iStop"""
+    hashes, sums = (_HASH_2, _SUMS_2) if twoTables else (_HASH_1, _SUMS_1)
+    for i in range(min(iStop + 1, 100)):
+        print("i: {}, qvalue: {}, hashes[i]:{}, qsum:{}, sums[i]{}".format(i, qvalue, hashes[i], qsum, sums[i]))
+
+
+def computeJPEGQuality_im_orig(qdict, verboseFlag):
+    """Returns JPEG quality of a JPEG image based on original ImageMagick
+    algorithm"""
+    if len(qdict) < 1:
+        return -1
+    qvalue, qsum, twoTables = getHashValues(qdict)
+    hashes, sums = (_HASH_2, _SUMS_2) if twoTables else (_HASH_1, _SUMS_1)
+    i = findStopIndex(qvalue, qsum, twoTables)
+    if verboseFlag:
+        printIterations(qvalue, qsum, twoTables, i)
+    if i < 100:
+        if (((qvalue <= hashes[i]) and (qsum <= sums[i])) or (i >= 50)):
+            return i+1
+    return -1
+
+
+def computeJPEGQuality_im_mod(qdict, verboseFlag):
+    """Returns JPEG quality and exactness flag of a JPEG image based on modified ImageMagick
+    algorithm that omits i >= 50 condition"""
+    if len(qdict) < 1:
+        return -1, False
+    qvalue, qsum, twoTables = getHashValues(qdict)
+    sums = _SUMS_2 if twoTables else _SUMS_1
+    i = findStopIndex(qvalue, qsum, twoTables)
+    if verboseFlag:
+        printIterations(qvalue, qsum, twoTables, i)
+    if i < 100:
+        quality = i+1
+        exact = qsum <= sums[i]
+        return quality, exact
+    return -1, False
+
+
+def findStopIndices(qvalues, qsums, twoTables):
+    """Vectorized version of findStopIndex for arrays of qvalue, qsum and
+    twoTables values. Returns array of indices"""
+    qvalues = np.asarray(qvalues)
+    qsums = np.asarray(qsums)
+    indices2 = np.minimum(np.searchsorted(_NEG_HASH_2, -qvalues, side='left'),
+                          np.searchsorted(_NEG_SUMS_2, -qsums, side='left'))
+    indices1 = np.minimum(np.searchsorted(_NEG_HASH_1, -qvalues, side='left'),
+                          np.searchsorted(_NEG_SUMS_1, -qsums, side='left'))
+    return np.where(twoTables, indices2, indices1)
+
+
+def computeJPEGQuality_im_batch(qvalues, qsums, twoTables):
+    """Batch version of both ImageMagick heuristics for arrays of qvalue,
+    qsum and twoTables values (see getHashValues). Returns arrays with
+    quality according to original algorithm, and quality and exactness flag
+    according to modified algorithm"""
+    qvalues = np.asarray(qvalues)
+    qsums = np.asarray(qsums)
+    twoTables = np.asarray(twoTables, dtype=bool)
+    indices = findStopIndices(qvalues, qsums, twoTables)
+    found = indices < 100
+    # Clip indices so that hash and sum values can be looked up for all
+    # rows (results of rows that weren't found are masked below)
+    iClip = np.minimum(indices, 99)
+    hashes = np.where(twoTables, np.array(_HASH_2)[iClip], np.array(_HASH_1)[iClip])
+    sums = np.where(twoTables, np.array(_SUMS_2)[iClip], np.array(_SUMS_1)[iClip])
+
+    exact = found & (qsums <= sums)
+    qualityOrig = np.where(found & (((qvalues <= hashes) & exact) | (indices >= 50)),
+                           indices + 1, -1)
+    qualityMod = np.where(found, indices + 1, -1)
+    return qualityOrig, qualityMod, exact
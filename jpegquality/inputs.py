@@ -0,0 +1,154 @@
+"""
+Input paths for the command line scripts.
+
+Besides a list of files on the command line (which relies on the shell to
+expand wildcards, and is limited by the maximum command line length), input
+files can be found by walking one or more directories, or read from a file
+with one path per line. These paths are streamed lazily, so no full list of
+paths is held in memory. Optionally they are sorted with bounded memory use.
+"""
+import collections
+import heapq
+import itertools
+import os
+import sys
+import tempfile
+
+# File extensions (lower case) of files that are included when walking
+# a directory
+JPEG_EXTENSIONS = ('.jpg', '.jpeg', '.jpe', '.jfif')
+
+# Maximum number of paths that are held in memory when sorting
+SORT_RUN_SIZE = 100000
+
+# Quantization tables of an input that was already read (e.g. an archive
+# member), with its name, size and modification time (ns), and whether it is
+# a file on disk (and not an archive member)
+InputTables = collections.namedtuple("InputTables", ["name", "size", "mtime", "qdict", "isFile"],
+                                     defaults=(False,))
+
+# Input that couldn't be read, with its name, size and modification time (ns)
+# (None if unknown), and error message
+InputError = collections.namedtuple("InputError", ["name", "size", "mtime", "message"])
+
+# Exceptions that are raised by reading (the quantization tables of) an input
+# that can't be read, or that isn't a valid JPEG file
+READ_ERRORS = (OSError, ValueError)
+
+
+def getErrorMessage(error):
+    """Returns message for exception that was raised while reading an input"""
+    return "{}: {}".format(type(error).__name__, error)
+
+
+def addInputArguments(parser):
+    """Add input file arguments to argument parser"""
+    parser.add_argument('JPEGsIn',
+                        action="store",
+                        type=str,
+                        nargs='*',
+                        help="input JPEG(s) (wildcards allowed)")
+    parser.add_argument('--recursive', '-r',
+                        action="append",
+                        type=str,
+                        help="walk directory recursively and use all files with JPEG \
+                        extension as input (can be used more than once)",
+                        dest="recursiveDirs",
+                        default=[])
+    parser.add_argument('--from-list',
+                        action="store",
+                        type=str,
+                        help="read input paths from file with one path per line \
+                        ('-' reads from standard input)",
+                        dest="fileList",
+                        default=None)
+    parser.add_argument('--sort',
+                        action="store_true",
+                        help="sort paths from --recursive and --from-list (uses temporary \
+                        files for large numbers of paths)",
+                        dest="sortFlag",
+                        default=False)
+
+
+def checkInputArguments(parser, args):
+    """Exit with error if no input was given"""
+    if not args.JPEGsIn and not args.recursiveDirs and args.fileList is None:
+        parser.error("no input files (use JPEGsIn, --recursive or --from-list)")
+
+
+def walkDirectory(dirIn, extensions=JPEG_EXTENSIONS):
+    """Generator that yields paths of all files in dirIn and its
+    subdirectories with one of extensions (in arbitrary order). Symbolic links
+    to directories are not followed. Directories that can't be read are
+    skipped (after the files that were found in them until then), and
+    reported on standard error"""
+    dirs = [dirIn]
+    while dirs:
+        currentDir = dirs.pop()
+        try:
+            with os.scandir(currentDir) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file() and entry.name.lower().endswith(extensions):
+                        yield entry.path
+        except OSError as e:
+            print("skipping directory {} ({})".format(currentDir, getErrorMessage(e)),
+                  file=sys.stderr)
+
+
+def readFileList(fileList):
+    """Generator that yields paths from file with one path per line (or from
+    standard input if fileList is '-'). Empty lines are skipped"""
+    if fileList == '-':
+        fIn = sys.stdin
+    else:
+        fIn = open(fileList, 'r', encoding='utf-8', errors='surrogateescape')
+    try:
+        for line in fIn:
+            path = line.rstrip('\r\n')
+            if path:
+                yield path
+    finally:
+        if fIn is not sys.stdin:
+            fIn.close()
+
+
+def sortPaths(paths, runSize=SORT_RUN_SIZE):
+    """Generator that yields paths in sorted order. Paths are sorted in runs
+    of runSize paths, which are written to temporary files and then merged,
+    so that no more than runSize paths are held in memory"""
+    paths = iter(paths)
+    run = sorted(itertools.islice(paths, runSize))
+    if len(run) < runSize:
+        # Everything fits in one run
+        yield from run
+        return
+
+    runFiles = []
+    try:
+        while run:
+            fRun = tempfile.TemporaryFile('w+', encoding='utf-8', errors='surrogateescape')
+            fRun.writelines(path + '\n' for path in run)
+            fRun.seek(0)
+            runFiles.append(fRun)
+            run = sorted(itertools.islice(paths, runSize))
+        yield from heapq.merge(*[(line.rstrip('\n') for line in fRun) for fRun in runFiles])
+    finally:
+        for fRun in runFiles:
+            fRun.close()
+
+
+def getInputPaths(args):
+    """Returns iterable of input paths from command line arguments. Paths
+    that are given as arguments are always sorted. Paths from --recursive and
+    --from-list are streamed lazily, and only sorted if --sort is set"""
+    streams = [walkDirectory(dirIn) for dirIn in args.recursiveDirs]
+    if args.fileList is not None:
+        streams.append(readFileList(args.fileList))
+    if not streams:
+        return sorted(args.JPEGsIn)
+    paths = itertools.chain(args.JPEGsIn, *streams)
+    if args.sortFlag:
+        return sortPaths(paths)
+    return paths
@@ -0,0 +1,513 @@
+"""
+Least squares matching of JPEG quantization tables against the standard
+tables from the JPEG ISO standard, for *all* possible quality levels. These
+are generated using Equations 1 and 2 in Kornblum (2008):
+
+https://www.sciencedirect.com/science/article/pii/S1742287608000285
+
+The standard tables for all 100 quality levels are computed once at import
+time, so that estimating the quality of an image comes down to a handful of
+NumPy array operations. Images with standard tables (the most common case)
+are matched exactly with a single lookup in an index of all standard tables.
+"""
+import array
+import math
+import numpy as np
+
+# Standard JPEG luminance and chrominance quantization tables
+# for 50% quality (ISO/IEC 10918-1 : 1993(E)), Annex K)
+LUM_BASE = np.array([16, 11, 10, 16, 24, 40, 51, 61,
+                     12, 12, 14, 19, 26, 58, 60, 55,
+                     14, 13, 16, 24, 40, 57, 69, 56,
+                     14, 17, 22, 29, 51, 87, 80, 62,
+                     18, 22, 37, 56, 68, 109, 103, 77,
+                     24, 35, 55, 64, 81, 104, 113, 92,
+                     49, 64, 78, 87, 103, 121, 120, 101,
+                     72, 92, 95, 98, 112, 100, 103, 99])
+
+CHROM_BASE = np.array([17, 18, 24, 47, 99, 99, 99, 99,
+                       18, 21, 26, 66, 99, 99, 99, 99,
+                       24, 26, 56, 99, 99, 99, 99, 99,
+                       47, 66, 99, 99, 99, 99, 99, 99,
+                       99, 99, 99, 99, 99, 99, 99, 99,
+                       99, 99, 99, 99, 99, 99, 99, 99,
+                       99, 99, 99, 99, 99, 99, 99, 99,
+                       99, 99, 99, 99, 99, 99, 99, 99])
+
+# Quality levels
+QUALITIES = np.arange(1, 101)
+
+
+def scaleTables(base, qBitDepth):
+    """Returns 100 x 64 array with standard tables derived from base table
+    for quality levels 1-100. Values are capped at 255 if qBitDepth is 8"""
+    # Scaling factor (Eq 1 in Kornblum, 2008)
+    S = np.where(QUALITIES < 50, 5000/QUALITIES, 200 - 2*QUALITIES)
+    # Standard table values from scaling factor (Eq 2 in Kornblum, 2008)
+    tables = np.floor((S[:, np.newaxis]*base + 50) / 100).astype(np.int64)
+    tables = np.maximum(tables, 1)
+    if qBitDepth == 8:
+        tables = np.minimum(tables, 255)
+    return tables
+
+
+# Standard tables for all quality levels, indexed by quantization table
+# bit depth. Each row holds the 64 luminance values, followed by the 64
+# chrominance values
+STANDARD_TABLES = {bitDepth: np.hstack((scaleTables(LUM_BASE, bitDepth),
+                                        scaleTables(CHROM_BASE, bitDepth)))
+                   for bitDepth in (8, 16)}
+
+
+def getBitDepth(qdict):
+    """Returns bit depth of quantization tables (16 if any value in the
+    luminance or chrominance table is greater than 255, 8 otherwise)"""
+    qBitDepth = 8
+    if max(qdict[0]) > 255:
+        qBitDepth = 16
+    if len(qdict) >= 2:
+        if max(qdict[1]) > 255:
+            qBitDepth = 16
+    return qBitDepth
+
+
+def getImageVector(qdict):
+    """Returns image luminance table, followed by chrominance table (if
+    present) as one array"""
+    if len(qdict) >= 2:
+        return np.concatenate((qdict[0], qdict[1])).astype(np.int64)
+    return np.asarray(qdict[0], dtype=np.int64)
+
+
+def computeSumSqMean(T, noTables):
+    """Returns sum of squared differences between summed luminance and
+    chrominance values and mean image quantization value (needed to
+    calculate Nash Efficiency)"""
+    Tmean = T.sum() / (noTables*64)
+    Tcombi = T.reshape(-1, 64).sum(axis=0)
+    return ((Tcombi - Tmean)**2).sum()
+
+
+def computeErrors(T, noTables, qBitDepth):
+    """Returns arrays with sum of squared errors and Nash-Sutcliffe
+    Efficiency for quality levels 1-100 for image table vector T, in one pass
+    over the standard tables"""
+    noValues = len(T)
+    Ts = STANDARD_TABLES[qBitDepth][:, :noValues]
+
+    # Sum of squared differences between image quantization values and
+    # corresponding values from standard q tables for each quality level
+    errors = ((Ts - T)**2).sum(axis=1)
+
+    # Nash-Sutcliffe Efficiency
+    nseVals = 1 - errors/computeSumSqMean(T, noTables)
+    return errors, nseVals
+
+
+def packTables(qdict):
+    """Returns luminance table, followed by chrominance table (if present)
+    packed as unsigned 16 bit values (key of STANDARD_INDEX). Any further
+    tables are not included"""
+    values = list(qdict[0])
+    if len(qdict) >= 2:
+        values += qdict[1]
+    return array.array('H', values).tobytes()
+
+
+def buildStandardIndex():
+    """Returns dictionary that maps the packed standard tables (see
+    packTables) of all quality levels, for both bit depths and for one or two
+    tables, to a tuple with all quality levels that have these tables (in
+    increasing order), their Nash-Sutcliffe Efficiency, and the margin
+    between the sum of squared errors of the runner-up level and the
+    (zero) smallest sum of squared errors"""
+    qualities = {}
+    bitDepths = {}
+    for bitDepth, tables in STANDARD_TABLES.items():
+        for quality, row in zip(QUALITIES.tolist(), tables):
+            if bitDepth == 16 and row.max() <= 255:
+                # Same as the 8 bit tables
+                continue
+            for noTables in (1, 2):
+                key = row[:64*noTables].astype(np.uint16).tobytes()
+                qualities.setdefault(key, []).append(quality)
+                bitDepths[key] = bitDepth
+
+    index = {}
+    for key, levels in qualities.items():
+        T = np.frombuffer(key, dtype=np.uint16).astype(np.int64)
+        sumSqMean = computeSumSqMean(T, len(T)//64)
+        # NSE is undefined if all summed values are equal (as with the
+        # tables for quality 100)
+        nse = 1.0 if sumSqMean > 0 else math.nan
+        errors = ((STANDARD_TABLES[bitDepths[key]][:, :len(T)] - T)**2).sum(axis=1)
+        margin = int(errors[errors > 0].min())
+        index[key] = (levels, nse, margin)
+    return index
+
+
+# Index of all standard tables, for exact matching
+STANDARD_INDEX = buildStandardIndex()
+
+
+def matchStandardTables(qdict):
+    """Returns list of all quality levels (in increasing order) whose
+    standard tables are identical to the image tables, corresponding
+    Nash-Sutcliffe Efficiency, and margin between the sum of squared errors of
+    the runner-up level and 0, using a single lookup in STANDARD_INDEX.
+    Returns None if the image tables are not standard tables. As with least
+    squares matching, only the luminance and chrominance tables are used"""
+    exactMatch = STANDARD_INDEX.get(packTables(qdict))
+    if exactMatch is not None and len(qdict) > 2 and math.isnan(exactMatch[1]):
+        # With more than 2 tables the mean quantization value (see
+        # computeSumSqMean) is taken over all tables, so NSE is defined
+        levels, _, margin = exactMatch
+        exactMatch = (levels, 1.0, margin)
+    return exactMatch
+
+
+def getTableQualities(qdict, quality):
+    """Returns lowest quality level with a standard luminance table that is
+    identical to the image luminance table, and the same for the chrominance
+    table (None if the image only has one table), for image tables that are
+    identical to the standard tables for quality"""
+    T = getImageVector(qdict)
+    Ts = STANDARD_TABLES[getBitDepth(qdict)]
+    levels = []
+    for columns in (slice(0, 64), slice(64, 128)):
+        if columns.start >= len(T):
+            levels.append(None)
+            continue
+        level = quality
+        # Table values never increase with quality, so all levels with
+        # identical tables are directly next to each other
+        while level > 1 and (Ts[level - 2, columns] == T[columns]).all():
+            level -= 1
+        levels.append(level)
+    return levels
+
+
+# Base tables as one vector (as returned by getImageVector), its squared
+# norm for one and two tables, and half width of the window of candidate
+# quality levels around the closed-form estimate
+BASE_VECTOR = np.concatenate((LUM_BASE, CHROM_BASE))
+BASE_NORMS = {64: int(LUM_BASE @ LUM_BASE), 128: int(BASE_VECTOR @ BASE_VECTOR)}
+CANDIDATE_WINDOW = 2
+
+
+def estimateQuality(T, qBitDepth):
+    """Returns closed-form quality estimate for image table vector T, by
+    inverting Eqs 1 and 2 in Kornblum (2008), and the residual (Euclidean
+    distance between T and the fitted tables). The scaling factor S is
+    estimated by least squares fit of T against the base tables"""
+    base = BASE_VECTOR[:len(T)]
+    baseNorm = BASE_NORMS[len(T)]
+    if qBitDepth == 8 and T.max() >= 255:
+        # Values that are capped at 255 would bias the estimate, so only
+        # use the others
+        uncapped = T < 255
+        if uncapped.any():
+            T = T[uncapped]
+            base = base[uncapped]
+            baseNorm = int(base @ base)
+    TBase = int(T @ base)
+    S = 100*TBase / baseNorm
+    if S > 100:
+        quality = 5000/S
+    else:
+        quality = (200 - S)/2
+    residual = math.sqrt(max(int(T @ T) - TBase*TBase/baseNorm, 0))
+    return min(max(round(quality), 1), 100), residual
+
+
+def getWindow(estimate):
+    """Returns first and last quality level of the window of candidate
+    levels around estimate"""
+    return max(estimate - CANDIDATE_WINDOW, 1), min(estimate + CANDIDATE_WINDOW, 100)
+
+
+def buildWindowBounds():
+    """Returns dictionaries, indexed by bit depth and number of values (64
+    for one table, 128 for two), with:
+
+    - 100 x 100 arrays with the smallest Euclidean distance between the
+      standard tables of each quality level (column) and those of all levels
+      outside the window of candidate levels around each estimate (row).
+      Only levels inside each window are filled in;
+    - arrays with the largest residual of the closed-form fit (see
+      estimateQuality) for each estimate at which a level inside the window
+      can still pass the check in computeErrorsWindow.
+    """
+    outsideDistances = {}
+    residualLimits = {}
+    for bitDepth, tables in STANDARD_TABLES.items():
+        for noValues in (64, 128):
+            Ts = tables[:, :noValues]
+            base = BASE_VECTOR[:noValues]
+            D = np.sqrt(((Ts[:, np.newaxis, :] - Ts[np.newaxis, :, :])**2).sum(axis=2))
+            # Distance between the standard tables of each level and the
+            # line through the base tables
+            offsets = np.sqrt(np.maximum((Ts**2).sum(axis=1) - (Ts @ base)**2/(base @ base), 0))
+            distances = np.full((100, 100), np.nan)
+            limits = np.empty(100)
+            for estimate in QUALITIES.tolist():
+                first, last = getWindow(estimate)
+                outside = np.r_[0:first - 1, last:100]
+                for level in range(first, last + 1):
+                    distances[estimate - 1, level - 1] = D[level - 1, outside].min()
+                window = slice(first - 1, last)
+                limits[estimate - 1] = distances[estimate - 1, window].max()/2 + offsets[window].max()
+            outsideDistances[bitDepth, noValues] = distances
+            residualLimits[bitDepth, noValues] = limits
+    return outsideDistances, residualLimits
+
+
+# Distances between standard tables inside and outside each window, for
+# bounding the errors of levels outside the window, and largest residuals
+# for which the window can be used
+OUTSIDE_DISTANCES, RESIDUAL_LIMITS = buildWindowBounds()
+
+
+def computeErrorsWindow(T, qBitDepth):
+    """Returns first quality level of the window of candidate levels around
+    the closed-form quality estimate for image table vector T, and array
+    with the sum of squared errors of each level in the window. Returns None
+    if any level outside the window could have the same or a smaller sum of
+    squared errors than the smallest one inside it, in which case all levels
+    must be compared.
+
+    By the triangle inequality, ||T - Ts[q]|| >= ||Ts[q] - Ts[best]|| -
+    ||T - Ts[best]||, so the distances between the standard tables give a
+    lower bound for the errors of all levels outside the window. For tables
+    that are close to the standard tables (the common case for non-standard
+    tables), this bound rules out all of them.
+
+    The residual of the closed-form fit gives a lower bound for the errors of
+    all levels, since the standard tables lie close to the line through the
+    base tables. If that bound is too large for the check to pass, None is
+    returned without computing any errors.
+    """
+    estimate, residual = estimateQuality(T, qBitDepth)
+    if residual >= RESIDUAL_LIMITS[qBitDepth, len(T)][estimate - 1]:
+        return None
+    first, last = getWindow(estimate)
+    errors = ((STANDARD_TABLES[qBitDepth][first - 1:last, :len(T)] - T)**2).sum(axis=1)
+    iMin = errors.argmin()
+    minError = int(errors[iMin])
+    outsideDistance = OUTSIDE_DISTANCES[qBitDepth, len(T)][estimate - 1, first - 1 + iMin]
+    # All levels outside the window have a larger sum of squared errors if
+    # (outsideDistance - sqrt(minError))**2 > minError. Since sums of squared
+    # errors are integers, minError + 0.5 is used instead, which leaves ample
+    # room for rounding errors
+    if outsideDistance < math.sqrt(minError) + math.sqrt(minError + 0.5):
+        return None
+    return first, errors
+
+
+def computeJPEGQuality_lsm_ties(qdict):
+    """Estimates JPEG quality using least squares matching between image
+    quantization tables and standard tables from the JPEG ISO standard.
+
+    Returns list of all quality levels with the smallest sum of squared errors
+    (in increasing order), root mean squared error of residuals between image
+    quantization coefficients and corresponding standard coefficients, and
+    Nash-Sutcliffe Efficiency measure.
+    """
+    noTables = len(qdict)
+
+    # Exact match with standard tables, which implies a sum of squared
+    # errors of 0
+    exactMatch = matchStandardTables(qdict)
+    if exactMatch is not None:
+        qualityEstimates, nse, _ = exactMatch
+        return list(qualityEstimates), 0.0, nse
+
+    # Tables that are close to the standard tables of some level only need
+    # to be compared with a few candidate levels (see computeErrorsWindow)
+    T = getImageVector(qdict)
+    qBitDepth = 16 if T.max() > 255 else 8
+    windowMatch = computeErrorsWindow(T, qBitDepth)
+    if windowMatch is not None:
+        first, errors = windowMatch
+        levels = QUALITIES[first - 1:first - 1 + len(errors)]
+        nseVals = 1 - errors/computeSumSqMean(T, noTables)
+    else:
+        levels = QUALITIES
+        errors, nseVals = computeErrors(T, noTables, qBitDepth)
+
+    # Smallest SSE. Value 0 indicates exact match with standard JPEG
+    # quantization tables. Any other value means non-standard tables were
+    # used, and quality estimate is an approximation
+    sumSqErrors = int(errors.min())
+    # List of all qualities that match sumSqErrors
+    qualityEstimates = levels[errors == sumSqErrors].tolist()
+    # Compute corresponding root mean squared error
+    rmsError = round(math.sqrt(sumSqErrors / (noTables * 64)), 3)
+    nse = round(float(nseVals.max()), 3)
+    return qualityEstimates, rmsError, nse
+
+
+def computeJPEGQuality_lsm(qdict):
+    """Estimates JPEG quality using least squares matching between image
+    quantization tables and standard tables from the JPEG ISO standard.
+
+    Returns quality estimate, root mean squared error of residuals between
+    image quantization coefficients and corresponding standard coefficients,
+    and Nash-Sutcliffe Efficiency measure.
+    """
+    qualityEstimates, rmsError, nse = computeJPEGQuality_lsm_ties(qdict)
+    # Quality is estimated as level with smallest sum of squared errors
+    # Note that this will return the smallest quality level in case
+    # the smallest SSE occurs for more than one level! Use
+    # computeJPEGQuality_lsm_ties to get all of them.
+    return qualityEstimates[0], rmsError, nse
+
+
+def getStandardTables(quality, qBitDepth):
+    """Returns standard luminance and chrominance tables (as lists) for
+    quality level and bit depth"""
+    tables = STANDARD_TABLES[qBitDepth][quality - 1]
+    return [tables[:64].tolist(), tables[64:].tolist()]
+
+
+# Standard tables as floating point matrices, and their squared norms
+# (luminance and chrominance separately), for the batch estimator below.
+# Since all values are integers well below 2**16, all sums of squares and
+# products are exact in double precision
+STANDARD_MATRICES = {bitDepth: tables.astype(np.float64)
+                     for bitDepth, tables in STANDARD_TABLES.items()}
+LUM_NORMS = {bitDepth: (tables[:, :64]**2).sum(axis=1)
+             for bitDepth, tables in STANDARD_MATRICES.items()}
+CHROM_NORMS = {bitDepth: (tables[:, 64:]**2).sum(axis=1)
+               for bitDepth, tables in STANDARD_MATRICES.items()}
+
+# Default number of images that are scored at once by the batch estimator.
+# Memory use is roughly chunkSize x 100 x 8 bytes for the matrix of errors
+CHUNK_SIZE = 10000
+
+
+def stackTables(qdicts):
+    """Returns N x 128 array with the luminance table (first 64 columns) and
+    chrominance table (last 64 columns) of N quantization table dictionaries,
+    and array with the number of tables of each image. The chrominance values
+    are 0 for images that only have one table"""
+    tables = np.zeros((len(qdicts), 128), dtype=np.float64)
+    noTables = np.empty(len(qdicts), dtype=np.int64)
+    for i, qdict in enumerate(qdicts):
+        tables[i, :64] = qdict[0]
+        if len(qdict) >= 2:
+            tables[i, 64:] = qdict[1]
+        noTables[i] = len(qdict)
+    return tables, noTables
+
+
+def scoreChunk(tables, noTables):
+    """Returns quality estimate, sum of squared errors and Nash-Sutcliffe
+    Efficiency for each row in tables (see computeJPEGQuality_lsm_batch),
+    followed by the quality estimate and sum of squared errors of the
+    luminance and chrominance tables separately"""
+    hasChrom = noTables >= 2
+    T = np.array(tables, dtype=np.float64)
+    T[~hasChrom, 64:] = 0
+    is16Bit = T.max(axis=1) > 255
+
+    # Sum of squared errors of the luminance and chrominance tables for each
+    # image and quality level, using ||T - Ts||^2 = ||T||^2 - 2 T.Ts + ||Ts||^2,
+    # so that the bulk of the work is one matrix multiplication for each
+    # table and bit depth
+    lumErrors = np.empty((len(T), 100))
+    chromErrors = np.empty((len(T), 100))
+    for bitDepth, rows in ((8, ~is16Bit), (16, is16Bit)):
+        if not rows.any():
+            continue
+        Ts = STANDARD_MATRICES[bitDepth]
+        for errors, columns, TsNorms in ((lumErrors, slice(0, 64), LUM_NORMS[bitDepth]),
+                                         (chromErrors, slice(64, 128), CHROM_NORMS[bitDepth])):
+            Trows = T[rows, columns]
+            errors[rows] = ((Trows**2).sum(axis=1)[:, np.newaxis]
+                            - 2*Trows @ Ts[:, columns].T
+                            + TsNorms)
+    errors = lumErrors + hasChrom[:, np.newaxis]*chromErrors
+
+    # Quality is estimated as level with smallest sum of squared errors
+    # (smallest quality level in case of ties, as computeJPEGQuality_lsm)
+    rowIndices = np.arange(len(T))
+    iMin = errors.argmin(axis=1)
+    sumSqErrors = errors[rowIndices, iMin]
+    iMinLum = lumErrors.argmin(axis=1)
+    iMinChrom = chromErrors.argmin(axis=1)
+
+    # All levels that tie with the smallest sum of squared errors (since all
+    # errors are exact integers, ties are exactly equal), and the margin to
+    # the runner-up level (infinite if all levels tie)
+    isTie = errors == sumSqErrors[:, np.newaxis]
+    margins = np.where(isTie, np.inf, errors).min(axis=1) - sumSqErrors
+
+    # Nash-Sutcliffe Efficiency, using summed luminance and chrominance
+    # values as computeErrors
+    Tmean = T.sum(axis=1) / (noTables*64)
+    Tcombi = T[:, :64] + T[:, 64:]
+    sumSqMean = ((Tcombi - Tmean[:, np.newaxis])**2).sum(axis=1)
+    nseVals = 1 - sumSqErrors/sumSqMean
+
+    return (iMin + 1, sumSqErrors, nseVals,
+            iMinLum + 1, lumErrors[rowIndices, iMinLum],
+            iMinChrom + 1, chromErrors[rowIndices, iMinChrom],
+            isTie, margins)
+
+
+def computeJPEGQuality_lsm_batch(tables, noTables, chunkSize=CHUNK_SIZE, perTable=False,
+                                 ties=False):
+    """Estimates JPEG quality of N images at once using least squares
+    matching. Takes N x 128 array with luminance and chrominance tables and
+    array with number of tables of each image (as returned by stackTables).
+    Images are scored in chunks of chunkSize rows to keep memory use bounded.
+
+    Returns arrays with quality estimates, root mean squared errors and
+    Nash-Sutcliffe Efficiency values. Unlike computeJPEGQuality_lsm, RMSE and
+    NSE are not rounded. If perTable is True, this is followed by arrays with
+    quality estimates and root mean squared errors of the luminance and the
+    chrominance tables separately (from the same pass). The chrominance
+    quality is 0 and its RMSE is NaN for images with one table. If ties is
+    True, this is followed by a list with arrays of all quality levels that
+    tie with the estimate (in increasing order), and arrays with the
+    smallest sum of squared errors and the margin between the sum of squared
+    errors of the runner-up level and the smallest one.
+    """
+    noTables = np.asarray(noTables)
+    n = len(noTables)
+    qualities = np.empty(n, dtype=np.int64)
+    sumSqErrors = np.empty(n)
+    nseVals = np.empty(n)
+    lumQualities = np.empty(n, dtype=np.int64)
+    lumSumSqErrors = np.empty(n)
+    chromQualities = np.empty(n, dtype=np.int64)
+    chromSumSqErrors = np.empty(n)
+    tiedQualities = []
+    margins = np.empty(n)
+
+    for start in range(0, n, chunkSize):
+        chunk = slice(start, start + chunkSize)
+        (qualities[chunk], sumSqErrors[chunk], nseVals[chunk],
+         lumQualities[chunk], lumSumSqErrors[chunk],
+         chromQualities[chunk], chromSumSqErrors[chunk],
+         isTie, margins[chunk]) = scoreChunk(tables[chunk], noTables[chunk])
+        if ties:
+            # Split column indices of all ties into one array for each row
+            rows, columns = np.nonzero(isTie)
+            tiedQualities += np.split(columns + 1, np.cumsum(isTie.sum(axis=1))[:-1])
+
+    # Root mean squared errors
+    rmsErrors = np.sqrt(np.maximum(sumSqErrors, 0) / (noTables*64))
+    results = (qualities, rmsErrors, nseVals)
+
+    if perTable:
+        hasChrom = noTables >= 2
+        lumRmsErrors = np.sqrt(np.maximum(lumSumSqErrors, 0) / 64)
+        chromRmsErrors = np.where(hasChrom, np.sqrt(np.maximum(chromSumSqErrors, 0) / 64),
+                                  np.nan)
+        chromQualities[~hasChrom] = 0
+        results += (lumQualities, lumRmsErrors, chromQualities, chromRmsErrors)
+    if ties:
+        results += (tiedQualities, sumSqErrors, margins)
+    return results
@@ -0,0 +1,468 @@
+"""
+Pipeline for estimating the quality of many JPEG files with all methods
+(original and modified ImageMagick heuristic, least squares matching).
+
+Files are read and scored in chunks, optionally by a pool of worker
+processes. Members of ZIP and TAR archives are read in the main process (see
+archives.py), and passed on as their quantization tables. Optionally, files
+are read ahead by a pool of reader threads in the main process as well
+(readAhead), which hides the latency of network storage. Results are cached
+by quantization table fingerprint, in memory and (optionally) in a
+persistent SQLite database.
+"""
+import collections
+import concurrent.futures
+import csv
+import functools
+import itertools
+import math
+import multiprocessing
+import os
+import threading
+from .qtables import (readQuantizationTables, readQuantizationTablesMmap,
+                      readQuantizationTablesPrefix, PREFIX_SIZE)
+from .lsm import (stackTables, computeJPEGQuality_lsm_batch, matchStandardTables,
+                  getTableQualities)
+from .imagemagick import (computeJPEGQuality_im_orig, computeJPEGQuality_im_mod,
+                          computeJPEGQuality_im_batch, getHashValues)
+from .cache import fingerprint, ResultCache, SQLiteCache
+from .inputs import InputTables, InputError, READ_ERRORS, getErrorMessage
+from .encoders import getLibrary
+
+# Names of result fields (after file name, and followed by error message of
+# inputs that couldn't be read)
+RESULT_FIELDS = ["q_im_orig", "q_im_mod", "exact_im_mod",
+                 "q_lsm", "rmse_lsm", "nse_lsm", "exact_lsm",
+                 "ties_lsm", "sse_lsm", "margin_lsm",
+                 "qlum_lsm", "rmse_lum_lsm", "qchrom_lsm", "rmse_chrom_lsm",
+                 "encoder_lib", "setting_lib", "rmse_lib"]
+
+# Version of the results, which is stored with each result in the persistent
+# cache. It is increased when the estimators change the results of existing
+# fields, so that results of earlier versions are scored again
+RESULT_VERSION = 2
+
+# Cache of results by quantization table fingerprint, and optional
+# persistent cache (one of each for each process)
+resultCache = ResultCache(0)
+resultDB = None
+useFileCache = False
+
+# Functions for reading quantization tables from an open file, by name
+READERS = {"stream": readQuantizationTables,
+           "mmap": readQuantizationTablesMmap,
+           "prefix": readQuantizationTablesPrefix}
+# Reader used by current process, and statistics of the prefix reader (see
+# readQuantizationTablesPrefix) since the last chunk
+readTables = readQuantizationTables
+readStats = collections.Counter()
+
+# Library of known encoder tables used by current process
+encoderLibrary = None
+
+# Connection to persistent cache of each reader thread (see readAhead)
+readerState = threading.local()
+
+# Number of files per worker task if the number of input files is unknown
+TASK_SIZE = 1000
+
+
+def scoreTables(qdicts, verboseFlag):
+    """Returns list with results of all estimators for list of quantization
+    table dictionaries. Standard tables are matched exactly by a lookup in
+    the index of standard tables, and least squares matching is done for all
+    other tables at once"""
+    exactMatches = [matchStandardTables(qdict) for qdict in qdicts]
+    nonStandard = [qdict for qdict, exactMatch in zip(qdicts, exactMatches)
+                   if exactMatch is None]
+    tables, noTables = stackTables(nonStandard)
+    (qs_lsm, rmses_lsm, nses_lsm,
+     qlums_lsm, rmses_lum_lsm, qchroms_lsm, rmses_chrom_lsm,
+     ties_lsm, sses_lsm, margins_lsm) = \
+        computeJPEGQuality_lsm_batch(tables, noTables, perTable=True, ties=True)
+    encoderMatches = encoderLibrary.match(qdicts)
+
+    if verboseFlag:
+        # Per-table version of ImageMagick heuristics, which can print the
+        # variables at each iteration
+        qs_im_orig = []
+        qs_im_mod = []
+        exacts_im_mod = []
+        for qdict in qdicts:
+            qs_im_orig.append(computeJPEGQuality_im_orig(qdict, verboseFlag))
+            q_im_mod, exact_im_mod = computeJPEGQuality_im_mod(qdict, verboseFlag)
+            qs_im_mod.append(q_im_mod)
+            exacts_im_mod.append(exact_im_mod)
+    else:
+        hashValues = [getHashValues(qdict) for qdict in qdicts]
+        qvalues, qsums, twoTables = zip(*hashValues) if hashValues else ((), (), ())
+        qs_im_orig, qs_im_mod, exacts_im_mod = computeJPEGQuality_im_batch(qvalues, qsums,
+                                                                           twoTables)
+
+    results = []
+    # Index of next result of least squares matching
+    j = 0
+    for i, exactMatch in enumerate(exactMatches):
+        q_im_orig = int(qs_im_orig[i])
+        q_im_mod = int(qs_im_mod[i])
+        exact_im_mod = bool(exacts_im_mod[i])
+        exact_lsm = exactMatch is not None
+        # Per-table estimates are None for the chrominance table of images
+        # with only one table
+        if exact_lsm:
+            # Lowest matching quality level, as least squares matching
+            qualities, nse_lsm, margin_lsm = exactMatch
+            q_lsm = qualities[0]
+            rmse_lsm = 0.0
+            tied = qualities
+            sse_lsm = 0
+            qlum_lsm, qchrom_lsm = getTableQualities(qdicts[i], q_lsm)
+            rmse_lum_lsm = 0.0
+            rmse_chrom_lsm = None if qchrom_lsm is None else 0.0
+        else:
+            q_lsm = int(qs_lsm[j])
+            rmse_lsm = round(float(rmses_lsm[j]), 3)
+            nse_lsm = round(float(nses_lsm[j]), 3)
+            tied = ties_lsm[j].tolist()
+            sse_lsm = int(sses_lsm[j])
+            # Margin is infinite if all levels tie
+            margin_lsm = int(margins_lsm[j]) if math.isfinite(margins_lsm[j]) else None
+            qlum_lsm = int(qlums_lsm[j])
+            rmse_lum_lsm = round(float(rmses_lum_lsm[j]), 3)
+            qchrom_lsm = rmse_chrom_lsm = None
+            if len(qdicts[i]) >= 2:
+                qchrom_lsm = int(qchroms_lsm[j])
+                rmse_chrom_lsm = round(float(rmses_chrom_lsm[j]), 3)
+            j += 1
+        encoder_lib, setting_lib, rmse_lib = encoderMatches[i]
+        results.append((q_im_orig, q_im_mod, exact_im_mod,
+                        q_lsm, rmse_lsm, nse_lsm, exact_lsm,
+                        " ".join(map(str, tied)), sse_lsm, margin_lsm,
+                        qlum_lsm, rmse_lum_lsm, qchrom_lsm, rmse_chrom_lsm,
+                        encoder_lib, setting_lib, round(rmse_lib, 3)))
+    return results
+
+
+def getReader(readMethod, prefixSize=PREFIX_SIZE, stats=None):
+    """Returns function that reads quantization tables from an open file
+    with reader readMethod (see READERS). The prefix reader reads prefixSize
+    bytes at first, and adds its statistics to stats"""
+    if readMethod == "prefix":
+        return functools.partial(readQuantizationTablesPrefix,
+                                 prefixSize=prefixSize, stats=stats)
+    return READERS[readMethod]
+
+
+def initWorker(cacheSize, cacheDB, cacheFilesFlag, readMethod="stream",
+               prefixSize=PREFIX_SIZE, libraryFiles=()):
+    """Initialize result cache, (if cacheDB is set) connection to
+    persistent cache, quantization table reader (see getReader) and encoder
+    library (bundled library, extended with libraryFiles) of current
+    process"""
+    global resultCache, resultDB, useFileCache, readTables, encoderLibrary
+    readTables = getReader(readMethod, prefixSize, readStats)
+    encoderLibrary = getLibrary(libraryFiles)
+    resultCache = ResultCache(cacheSize)
+    if cacheDB is not None:
+        resultDB = SQLiteCache(cacheDB)
+        useFileCache = cacheFilesFlag
+
+
+def lookupResult(key):
+    """Returns cached result for fingerprint from in-memory cache, or else
+    from persistent cache (if used). Returns None if there is no result"""
+    result = resultCache.get(key)
+    if result is None and resultDB is not None:
+        stored = resultDB.getResult(key)
+        # Entries that lack any fields, that were matched against another
+        # encoder library, or that are from another version, are treated as
+        # missing
+        if (stored is not None and all(field in stored for field in RESULT_FIELDS)
+                and stored.get("library") == encoderLibrary.id
+                and stored.get("version") == RESULT_VERSION):
+            result = tuple(stored[field] for field in RESULT_FIELDS)
+            resultCache.put(key, result)
+    return result
+
+
+def checkTables(qdict):
+    """Raise ValueError if quantization table dictionary lacks the tables
+    that the estimators need (the luminance table, and the chrominance table
+    if there is more than one table)"""
+    if not qdict:
+        raise ValueError("no quantization tables")
+    if 0 not in qdict or (len(qdict) >= 2 and 1 not in qdict):
+        raise ValueError("unexpected quantization table identifiers {}".format(sorted(qdict)))
+
+
+def readInputTables(JPEG):
+    """Returns quantization tables of file JPEG, using the reader of current
+    process. Raises ValueError if the tables can't be used (see
+    checkTables)"""
+    with open(JPEG, 'rb') as fIn:
+        qdict = readTables(fIn)
+    checkTables(qdict)
+    return qdict
+
+
+def readInput(JPEG):
+    """Returns InputTables for file JPEG (or InputError if it can't be read),
+    and fingerprint of its quantization tables (None for errors). If the
+    file cache is used and the fingerprint of the file is known, the file is
+    not opened, and the tables are None"""
+    try:
+        fileStat = os.stat(JPEG)
+    except OSError as e:
+        return InputError(JPEG, None, None, getErrorMessage(e)), None
+    size = fileStat.st_size
+    mtime = fileStat.st_mtime_ns
+    if useFileCache:
+        key = resultDB.getFingerprint(JPEG, size, mtime)
+        if key is not None:
+            return InputTables(JPEG, size, mtime, None, True), key
+    try:
+        qdict = readInputTables(JPEG)
+    except READ_ERRORS as e:
+        return InputError(JPEG, size, mtime, getErrorMessage(e)), None
+    return InputTables(JPEG, size, mtime, qdict, True), fingerprint(qdict)
+
+
+def scoreFiles(JPEGs, verboseFlag):
+    """Read quantization tables of list of JPEGs (paths, or InputTables of
+    inputs that were already read, or InputError of inputs that couldn't be
+    read), and return dictionary with:
+
+    - rows: result row for each file
+    - fileStats: path, size and modification time of each file (for the
+      checkpoint file)
+    - hits, misses: number of hits and misses of the in-memory result
+      cache (see ResultCache) while scoring the chunk
+    - scored: number of distinct table sets that were scored
+    - newResults, newFingerprints: new entries for persistent cache
+    - readStats: statistics of the prefix reader (empty for other readers)
+
+    Only tables that are not in the result cache are scored. If the file
+    cache is used, files whose fingerprint is known are not opened. Inputs
+    that can't be read (or that lack the tables the estimators need) get a
+    row with an error message instead of results, and are still added to
+    the checkpoint (unless their size and modification time are unknown),
+    so that they are not read again by a resumed run.
+    """
+    fileStats = []
+    names = []
+    keys = []
+    newFingerprints = []
+    # Counters of result cache at start of chunk
+    hits = resultCache.hits
+    misses = resultCache.misses
+    # Results for all distinct tables in this chunk, by fingerprint
+    chunkResults = {}
+    # Distinct tables that are not in the cache yet, by fingerprint
+    newTables = {}
+    # Error message of each input that couldn't be read, by position in chunk
+    errors = {}
+    for JPEG in JPEGs:
+        key = None
+        if not isinstance(JPEG, (InputTables, InputError)):
+            JPEG, key = readInput(JPEG)
+        elif isinstance(JPEG, InputTables):
+            # Input that was already read (archive member, or file from
+            # readAhead)
+            try:
+                checkTables(JPEG.qdict)
+            except ValueError as e:
+                JPEG = InputError(JPEG.name, JPEG.size, JPEG.mtime, getErrorMessage(e))
+        names.append(JPEG.name)
+        if JPEG.size is not None:
+            fileStats.append([JPEG.name, JPEG.size, JPEG.mtime])
+        if isinstance(JPEG, InputError):
+            errors[len(keys)] = JPEG.message
+            keys.append(None)
+            continue
+        qdict = JPEG.qdict
+        if key is None:
+            key = fingerprint(qdict)
+        if JPEG.isFile and useFileCache and qdict is not None:
+            newFingerprints.append((JPEG.name, JPEG.size, JPEG.mtime, key))
+        keys.append(key)
+        if key in chunkResults or key in newTables:
+            # Same tables as an earlier file in this chunk
+            continue
+        result = lookupResult(key)
+        if result is not None:
+            chunkResults[key] = result
+            continue
+        if qdict is None:
+            # Fingerprint known, but result isn't, so tables must be read
+            try:
+                qdict = readInputTables(JPEG.name)
+            except READ_ERRORS as e:
+                errors[len(keys) - 1] = getErrorMessage(e)
+                keys[-1] = None
+                continue
+        newTables[key] = qdict
+
+    newResults = scoreTables(list(newTables.values()), verboseFlag)
+    for key, result in zip(newTables, newResults):
+        resultCache.put(key, result)
+        chunkResults[key] = result
+
+    rows = []
+    for i, (name, key) in enumerate(zip(names, keys)):
+        if key is None:
+            rows.append([name, *[None]*len(RESULT_FIELDS), errors[i]])
+        else:
+            rows.append([name, *chunkResults[key], None])
+    chunkStats = dict(readStats)
+    readStats.clear()
+    return {"rows": rows,
+            "fileStats": fileStats,
+            "hits": resultCache.hits - hits,
+            "misses": resultCache.misses - misses,
+            "scored": len(newTables),
+            "newResults": {key: dict(zip(RESULT_FIELDS, result),
+                                     library=encoderLibrary.id,
+                                     version=RESULT_VERSION)
+                           for key, result in zip(newTables, newResults)},
+            "newFingerprints": newFingerprints,
+            "readStats": chunkStats}
+
+
+def getChunks(JPEGs, chunkSize):
+    """Generator that yields successive chunks (lists) of chunkSize files
+    from iterable JPEGs"""
+    JPEGs = iter(JPEGs)
+    while True:
+        chunk = list(itertools.islice(JPEGs, chunkSize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def scoreAll(JPEGs, verboseFlag, chunkSize, workers, workerArgs):
+    """Generator that yields results (see scoreFiles) for successive chunks
+    of files, in the same order as JPEGs (which can be any iterable). If
+    workers is greater than 1, the chunks are read and scored by a pool of
+    worker processes, each with its own result cache. Each process is
+    initialized with workerArgs (see initWorker)"""
+    scoreChunk = functools.partial(scoreFiles, verboseFlag=verboseFlag)
+    if workers <= 1:
+        initWorker(*workerArgs)
+        yield from map(scoreChunk, getChunks(JPEGs, chunkSize))
+        return
+
+    # Use smaller chunks if needed so that the work is spread evenly over
+    # all workers (with a few chunks per worker for load balancing). If the
+    # number of files isn't known in advance, TASK_SIZE is used
+    if hasattr(JPEGs, '__len__'):
+        taskSize = min(chunkSize, max(1, math.ceil(len(JPEGs) / (4*workers))))
+    else:
+        taskSize = min(chunkSize, TASK_SIZE)
+
+    # Chunks are submitted as results come in, with no more than
+    # 2*workers chunks in flight, so that memory use stays bounded for any
+    # number of input files. Results are yielded in order of submission
+    with multiprocessing.Pool(workers, initializer=initWorker,
+                              initargs=workerArgs) as pool:
+        inFlight = collections.deque()
+        for chunk in getChunks(JPEGs, taskSize):
+            inFlight.append(pool.apply_async(scoreChunk, (chunk,)))
+            if len(inFlight) >= 2*workers:
+                yield inFlight.popleft().get()
+        while inFlight:
+            yield inFlight.popleft().get()
+
+
+def initReader(cacheDB):
+    """Initialize connection to persistent cache (if cacheDB is set) of
+    current reader thread"""
+    readerState.db = None
+    if cacheDB is not None:
+        readerState.db = SQLiteCache(cacheDB)
+
+
+def readFile(JPEG, readMethod, prefixSize=PREFIX_SIZE):
+    """Returns InputTables with quantization tables, size and modification
+    time of file, using reader readMethod (see getReader), and Counter with
+    statistics of the prefix reader. If the reader thread has a connection
+    to the file cache (see initReader) and the fingerprint of the file is
+    known, the file isn't opened, and its path is returned instead. Returns
+    InputError if the file can't be read"""
+    stats = collections.Counter()
+    try:
+        fileStat = os.stat(JPEG)
+    except OSError as e:
+        return InputError(JPEG, None, None, getErrorMessage(e)), stats
+    db = getattr(readerState, "db", None)
+    if db is not None and db.getFingerprint(JPEG, fileStat.st_size,
+                                            fileStat.st_mtime_ns) is not None:
+        # Tables are only read by scoreFiles if the result isn't cached
+        return JPEG, stats
+    try:
+        with open(JPEG, 'rb') as fIn:
+            qdict = getReader(readMethod, prefixSize, stats)(fIn)
+    except READ_ERRORS as e:
+        return InputError(JPEG, fileStat.st_size, fileStat.st_mtime_ns,
+                          getErrorMessage(e)), stats
+    return InputTables(JPEG, fileStat.st_size, fileStat.st_mtime_ns, qdict, True), stats
+
+
+def readAhead(JPEGs, readers, readMethod="stream", prefixSize=PREFIX_SIZE, stats=None,
+              cacheDB=None):
+    """Generator that yields InputTables (or InputError) for all files in
+    iterable JPEGs, in the same order. Files are read by a pool of readers
+    threads, so that up to readers reads are waiting for storage at the same
+    time. Reads are submitted as results are consumed, with no more than
+    2*readers files in flight, so that memory use stays bounded. Items that
+    are already InputTables or InputError (archive members) are passed on
+    unchanged. If cacheDB is set, files whose fingerprint is in its file
+    cache are not read, and are passed on as paths. Statistics of the prefix
+    reader are added to stats (a Counter) as files are yielded"""
+    with concurrent.futures.ThreadPoolExecutor(readers, initializer=initReader,
+                                               initargs=(cacheDB,)) as executor:
+        inFlight = collections.deque()
+        for JPEG in JPEGs:
+            if isinstance(JPEG, (InputTables, InputError)):
+                future = concurrent.futures.Future()
+                future.set_result((JPEG, {}))
+            else:
+                future = executor.submit(readFile, JPEG, readMethod, prefixSize)
+            inFlight.append(future)
+            if len(inFlight) >= 2*readers:
+                yield getReadResult(inFlight.popleft(), stats)
+        while inFlight:
+            yield getReadResult(inFlight.popleft(), stats)
+
+
+def getReadResult(future, stats):
+    """Returns InputTables (or path, or InputError) from finished readFile
+    future, and adds its statistics to stats (if not None)"""
+    inputTables, fileStats = future.result()
+    if stats is not None:
+        stats.update(fileStats)
+    return inputTables
+
+
+def readCheckpoint(checkpointFile):
+    """Returns dictionary with (size, modification time) of all files in
+    checkpoint file, indexed by path"""
+    scored = {}
+    with open(checkpointFile, 'r', newline='', encoding='utf-8') as fIn:
+        for JPEG, size, mtime in csv.reader(fIn):
+            scored[JPEG] = (int(size), int(mtime))
+    return scored
+
+
+def isScored(JPEG, scored):
+    """Returns True if JPEG (path, InputTables or InputError) is in
+    checkpoint, and wasn't changed since"""
+    if isinstance(JPEG, (InputTables, InputError)):
+        return scored.get(JPEG.name) == (JPEG.size, JPEG.mtime)
+    if JPEG not in scored:
+        return False
+    try:
+        fileStat = os.stat(JPEG)
+    except OSError:
+        # Scored again, which gives an error row
+        return False
+    return scored[JPEG] == (fileStat.st_size, fileStat.st_mtime_ns)
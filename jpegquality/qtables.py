@@ -0,0 +1,231 @@
+"""
+Read JPEG quantization tables directly from the marker segments in the file
+header, without decoding any image data.
+
+The returned tables follow the same conventions as Pillow's
+image.quantization attribute (a dictionary of 64-value lists indexed by table
+identifier, with values in natural instead of zigzag order), so they can be
+used as a drop-in replacement for:
+
+```
+im = Image.open(fIn)
+im.load()
+qdict = im.quantization
+```
+
+Tables can be read from an open file object (readQuantizationTables), from a
+memory-mapped file (readQuantizationTablesMmap), from the first few KB of the
+file (readQuantizationTablesPrefix), or from a bytes-like object that holds
+the start of the file (parseQuantizationTables).
+"""
+import mmap
+import os
+
+# Natural (row-major) position of each coefficient in zigzag order
+# (ISO/IEC 10918-1 : 1993(E), Figure A.6)
+ZIGZAG = [0, 1, 8, 16, 9, 2, 3, 10,
+          17, 24, 32, 25, 18, 11, 4, 5,
+          12, 19, 26, 33, 40, 48, 41, 34,
+          27, 20, 13, 6, 7, 14, 21, 28,
+          35, 42, 49, 56, 57, 50, 43, 36,
+          29, 22, 15, 23, 30, 37, 44, 51,
+          58, 59, 52, 45, 38, 31, 39, 46,
+          53, 60, 61, 54, 47, 55, 62, 63]
+
+# Marker codes (second byte after 0xFF)
+SOI = 0xD8
+EOI = 0xD9
+SOS = 0xDA
+DQT = 0xDB
+TEM = 0x01
+RST0 = 0xD0
+RST7 = 0xD7
+
+# Default number of bytes that are read by readQuantizationTablesPrefix
+PREFIX_SIZE = 4096
+
+
+def parseDQT(segment, qdict):
+    """Parse payload of one DQT marker segment (i.e. without the marker and
+    length fields), and add its table(s) to qdict. A single segment may
+    define multiple tables, each of which can have 8 or 16 bit precision"""
+    pos = 0
+    while pos < len(segment):
+        # Upper 4 bits: precision (0 = 8 bit, 1 = 16 bit), lower 4 bits: table id
+        precision = segment[pos] >> 4
+        tableId = segment[pos] & 15
+        pos += 1
+        if precision == 0:
+            values = segment[pos:pos + 64]
+            pos += 64
+        elif precision == 1:
+            raw = segment[pos:pos + 128]
+            values = [(raw[i] << 8) | raw[i + 1] for i in range(0, len(raw), 2)]
+            pos += 128
+        else:
+            raise ValueError("bad quantization table precision {}".format(precision))
+        if len(values) != 64:
+            raise ValueError("truncated quantization table")
+        # De-zigzag values so they are in natural order (as Pillow)
+        table = [0]*64
+        for i in range(64):
+            table[ZIGZAG[i]] = values[i]
+        qdict[tableId] = table
+
+
+def readQuantizationTables(fIn):
+    """Read quantization tables from open (binary mode) JPEG file object
+    (which may also be a file-like object, e.g. an archive member).
+    Walks the marker segments from SOI until the first SOS marker, and only
+    reads the payload of DQT segments; all other segments are skipped.
+    Returns dictionary with tables indexed by table identifier. Raises
+    ValueError if the file ends before the first SOS marker"""
+
+    qdict = {}
+
+    if fIn.read(2) != b'\xff\xd8':
+        raise ValueError("not a JPEG file (no SOI marker)")
+
+    while True:
+        byte = fIn.read(1)
+        if not byte:
+            raise ValueError("unexpected end of file")
+        if byte != b'\xff':
+            # Other bytes between marker segments are skipped (as Pillow does)
+            continue
+        # Any number of 0xFF fill bytes may precede a marker
+        marker = 0xFF
+        while marker == 0xFF:
+            byte = fIn.read(1)
+            if not byte:
+                raise ValueError("unexpected end of file")
+            marker = byte[0]
+        if marker == 0:
+            # 0xFF00 is not a marker, so it's skipped as well
+            continue
+        if marker in (SOS, EOI):
+            break
+        if marker in (SOI, TEM) or RST0 <= marker <= RST7:
+            # Stand-alone markers without a length field
+            continue
+        lengthBytes = fIn.read(2)
+        if len(lengthBytes) != 2:
+            raise ValueError("unexpected end of file")
+        # Segment length includes the length field itself
+        length = int.from_bytes(lengthBytes, 'big') - 2
+        if length < 0:
+            raise ValueError("bad segment length")
+        if marker == DQT:
+            segment = fIn.read(length)
+            if len(segment) != length:
+                raise ValueError("unexpected end of file")
+            parseDQT(segment, qdict)
+        elif fIn.seekable():
+            fIn.seek(length, 1)
+        else:
+            # Streams that can't seek (e.g. pipes) are read instead
+            if len(fIn.read(length)) != length:
+                raise ValueError("unexpected end of file")
+
+    return qdict
+
+
+def parseQuantizationTables(data):
+    """Parse quantization tables from bytes-like object (e.g. bytes or mmap)
+    that holds (the start of) a JPEG file. Jumps from marker to marker using
+    the segment lengths, so that only the marker headers and the DQT
+    segments are accessed.
+
+    Returns dictionary with tables indexed by table identifier, and flag that
+    is True if the first SOS (or EOI) marker was reached, which means that all
+    tables were found. The flag is False if data ends before that.
+    """
+    qdict = {}
+    size = len(data)
+
+    if data[:2] != b'\xff\xd8':
+        raise ValueError("not a JPEG file (no SOI marker)")
+    pos = 2
+
+    while pos < size:
+        if data[pos] != 0xFF:
+            # Other bytes between marker segments are skipped (as Pillow does)
+            pos = data.find(b'\xff', pos)
+            if pos < 0:
+                break
+        # Any number of 0xFF fill bytes may precede a marker
+        while pos < size and data[pos] == 0xFF:
+            pos += 1
+        if pos >= size:
+            break
+        marker = data[pos]
+        pos += 1
+        if marker == 0:
+            # 0xFF00 is not a marker, so it's skipped as well
+            continue
+        if marker in (SOS, EOI):
+            return qdict, True
+        if marker in (SOI, TEM) or RST0 <= marker <= RST7:
+            # Stand-alone markers without a length field
+            continue
+        if pos + 2 > size:
+            break
+        # Segment length includes the length field itself
+        length = int.from_bytes(data[pos:pos + 2], 'big')
+        if length < 2:
+            raise ValueError("bad segment length")
+        if marker == DQT:
+            if pos + length > size:
+                break
+            parseDQT(data[pos + 2:pos + length], qdict)
+        pos += length
+
+    return qdict, False
+
+
+def readQuantizationTablesMmap(fIn):
+    """Read quantization tables from open (binary mode) JPEG file object
+    by memory-mapping the file, so that only the pages that hold the marker
+    headers and DQT segments are read from storage, irrespective of file
+    size. Returns dictionary with tables indexed by table identifier.
+    Raises ValueError if the file ends before the first SOS marker"""
+    if os.fstat(fIn.fileno()).st_size == 0:
+        raise ValueError("not a JPEG file (empty file)")
+    with mmap.mmap(fIn.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        qdict, complete = parseQuantizationTables(data)
+    if not complete:
+        raise ValueError("unexpected end of file")
+    return qdict
+
+
+def readQuantizationTablesPrefix(fIn, prefixSize=PREFIX_SIZE, stats=None):
+    """Read quantization tables from open (binary mode) JPEG file object
+    with a single read of the first prefixSize bytes, which is normally
+    enough to reach the first SOS marker. If it isn't, the data read so far
+    is doubled until the SOS marker is reached (or the file ends).
+
+    Returns dictionary with tables indexed by table identifier, and raises
+    ValueError if the file ends before the first SOS marker. If stats (a
+    collections.Counter) is given, the number of files ("files"), files that
+    needed more than one read ("extended") and bytes read ("bytes") are added
+    to it"""
+    # At least the SOI marker is needed to start parsing
+    data = fIn.read(max(prefixSize, 2))
+    extended = False
+    while True:
+        qdict, complete = parseQuantizationTables(data)
+        if complete:
+            break
+        more = fIn.read(len(data))
+        if not more:
+            # End of file reached without SOS
+            break
+        data += more
+        extended = True
+    if stats is not None:
+        stats["files"] += 1
+        stats["extended"] += extended
+        stats["bytes"] += len(data)
+    if not complete:
+        raise ValueError("unexpected end of file")
+    return qdict
@@ -0,0 +1,84 @@
+#! /usr/bin/env python3
+"""
+Check that an interrupted run of jpegquality-compare.py that is completed
+with --resume gives the same results as a single run. The input files are
+also put in a ZIP archive, so that resuming is checked for archive members as
+well. Exits with status 1 if the results differ.
+"""
+
+import os
+import sys
+import argparse
+import csv
+import subprocess
+import tempfile
+import zipfile
+
+COMPARE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "jpegquality-compare.py")
+
+
+def parseCommandLine():
+    """Parse command line"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('JPEGsIn',
+                        action="store",
+                        type=str,
+                        nargs='+',
+                        help="input JPEGs (at least 2)")
+    parser.add_argument('--workers',
+                        action="store",
+                        type=int,
+                        help="number of worker processes (default: 1)",
+                        dest="workers",
+                        default=1)
+
+    # Parse arguments
+    args = parser.parse_args()
+    if len(args.JPEGsIn) < 2:
+        parser.error("at least 2 input JPEGs are needed")
+
+    return args
+
+
+def runCompare(inputs, fileOut, workers, resumeFlag=False):
+    """Run jpegquality-compare.py on inputs, and return sorted rows of
+    output file (without header)"""
+    command = [sys.executable, COMPARE_SCRIPT, "--out", fileOut,
+               "--workers", str(workers), *inputs]
+    if resumeFlag:
+        command.append("--resume")
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    with open(fileOut, 'r', newline='', encoding='utf-8') as fIn:
+        rows = list(csv.reader(fIn))
+    return sorted(rows[1:])
+
+
+def main():
+    args = parseCommandLine()
+    myJPEGs = args.JPEGsIn
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        archive = os.path.join(tempDir, "inputs.zip")
+        with zipfile.ZipFile(archive, 'w') as zipOut:
+            for i, myJPEG in enumerate(myJPEGs):
+                zipOut.write(myJPEG, "{}-{}".format(i, os.path.basename(myJPEG)))
+        inputs = [*myJPEGs, archive]
+
+        rowsSingle = runCompare(inputs, os.path.join(tempDir, "single.csv"), args.workers)
+
+        # Interrupted run: only the first half of the files and the archive
+        # are scored, and the run is then resumed with all inputs
+        fileOut = os.path.join(tempDir, "resumed.csv")
+        runCompare([*myJPEGs[:len(myJPEGs)//2], archive], fileOut, args.workers)
+        rowsResumed = runCompare(inputs, fileOut, args.workers, resumeFlag=True)
+
+    if rowsResumed != rowsSingle:
+        print("resumed run differs from single run: {} against {} rows".format(len(rowsResumed),
+                                                                           len(rowsSingle)))
+        sys.exit(1)
+    print("resumed run matches single run ({} rows)".format(len(rowsSingle)))
+
+
+if __name__ == "__main__":
+    main()